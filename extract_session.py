@@ -12,14 +12,28 @@ python extract_session.py
 """
 
 import asyncio
-import json
 from pathlib import Path
 
+import orjson
+from playwright.async_api import async_playwright
+
 SESSION_FILE = Path('browser_state.json')
+TOKENS_FILE = Path('session.json')
+
+# Same lean flags as monitor.py, but keep the GPU for the visible window
+CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--disable-features=Translate,BackForwardCache,MediaRouter',
+    '--js-flags=--max-old-space-size=256',
+]
 
 async def main():
-    from playwright.async_api import async_playwright
-    
     print("=" * 50)
     print("🔐 FTTH Session Extractor")
     print("=" * 50)
@@ -30,8 +44,7 @@ async def main():
     
     browser = await p.chromium.launch(
         headless=False,  # ⚠️ مهم: نفتح البراوزر عشان المستخدم يشوف ويتعامل مع 2FA
-        args=['--no-sandbox'],
-        slow_mo=100  # أبطأ شوية عشان نشوف اللي بيحصل
+        args=CHROMIUM_ARGS,
     )
     
     # Try to load existing session if available
@@ -50,7 +63,14 @@ async def main():
     
     print("⏳ Navigating to dashboard...")
     await page.goto('https://admin.ftth.iq/dashboard', timeout=120000)
-    await asyncio.sleep(3)
+    # Settle as soon as we either land on SSO or the app has stored a token
+    try:
+        await page.wait_for_function(
+            "() => location.host.startsWith('sso.') || !!localStorage.getItem('access_token')",
+            timeout=30000, polling=200
+        )
+    except:
+        pass
     
     # Check current URL to determine state
     current_url = page.url
@@ -68,12 +88,11 @@ async def main():
             
             # Save tokens separately
             refresh_token = await page.evaluate("localStorage.getItem('refresh_token')")
-            with open('session.json', 'w') as f:
-                json.dump({
-                    'access_token': access_token,
-                    'refresh_token': refresh_token,
-                    'saved_at': str(asyncio.get_event_loop().time())
-                }, f, indent=2)
+            TOKENS_FILE.write_bytes(orjson.dumps({
+                'access_token': access_token,
+                'refresh_token': refresh_token,
+                'saved_at': str(asyncio.get_event_loop().time())
+            }, option=orjson.OPT_INDENT_2))
             print("💾 Tokens saved to: session.json")
         else:
             print("⚠️ No token - session may be expired")
@@ -81,8 +100,6 @@ async def main():
         # Need to login
         print("🔐 Login required...")
         
-        # Wait a bit for SSO redirect
-        await asyncio.sleep(3)
         current_url = page.url
         print(f"📍 Login URL: {current_url}")
         
@@ -90,53 +107,49 @@ async def main():
         username_filled = False
         
         # Angular Material uses formcontrolname attributes
-        selectors = [
+        # One CSS selector list → one DOM query, first match wins (no stacked timeouts)
+        user_sel = ",".join([
             'input[formcontrolname="Username"]',  # Angular Material - CORRECT!
             'input[formcontrolname="username"]',  # lowercase fallback
             '#mat-input-0',                       # ID fallback
             'input[name="username"]',             # Standard
-        ]
+        ])
         
-        for selector in selectors:
-            try:
-                await page.wait_for_selector(selector, state="visible", timeout=5000)
-                print(f"🔑 Found login field: {selector}")
-                await page.fill(selector, 'sla')
-                username_filled = True
-                break
-            except:
-                continue
+        try:
+            loc = page.locator(user_sel).first
+            await loc.wait_for(state="visible", timeout=10000)
+            print("🔑 Found login field")
+            await loc.fill('sla')
+            username_filled = True
+        except:
+            pass
         
         if username_filled:
             # Try to fill password - Angular Material uses formcontrolname
-            password_selectors = [
+            password_sel = ",".join([
                 'input[formcontrolname="Password"]',  # Angular Material - CORRECT!
                 'input[formcontrolname="password"]',  # lowercase fallback
                 '#mat-input-1',                       # ID fallback
                 'input[type="password"]',             # Generic
-            ]
-            for selector in password_selectors:
-                try:
-                    await page.fill(selector, 'Sla951951sla')
-                    print("🔑 Password filled")
-                    break
-                except:
-                    continue
+            ])
+            try:
+                await page.locator(password_sel).first.fill('Sla951951sla', timeout=10000)
+                print("🔑 Password filled")
+            except:
+                pass
             
             # Try to submit - Angular Material button
-            submit_selectors = [
+            submit_sel = ",".join([
                 'button.mat-raised-button',           # Angular Material - CORRECT!
                 'button.btn-xl',                      # By class
                 'button:has-text("تسجيل الدخول")',
                 'button[type="submit"]',
-            ]
-            for selector in submit_selectors:
-                try:
-                    await page.click(selector)
-                    print("🔑 Form submitted")
-                    break
-                except:
-                    continue
+            ])
+            try:
+                await page.locator(submit_sel).first.click(timeout=10000)
+                print("🔑 Form submitted")
+            except:
+                pass
         else:
             print("⚠️ Login form not found")
             print("   📝 Please login manually in the browser window...")
@@ -155,7 +168,13 @@ async def main():
             return
         
         # Wait for tokens to be set
-        await asyncio.sleep(5)
+        try:
+            await page.wait_for_function(
+                "() => !!localStorage.getItem('access_token')",
+                timeout=30000, polling=200
+            )
+        except:
+            pass
         
         # Save the session
         await context.storage_state(path=str(SESSION_FILE))
@@ -166,12 +185,11 @@ async def main():
         refresh_token = await page.evaluate("localStorage.getItem('refresh_token')")
         
         if access_token:
-            with open('session.json', 'w') as f:
-                json.dump({
-                    'access_token': access_token,
-                    'refresh_token': refresh_token,
-                    'saved_at': str(asyncio.get_event_loop().time())
-                }, f, indent=2)
+            TOKENS_FILE.write_bytes(orjson.dumps({
+                'access_token': access_token,
+                'refresh_token': refresh_token,
+                'saved_at': str(asyncio.get_event_loop().time())
+            }, option=orjson.OPT_INDENT_2))
             print("💾 Tokens saved to: session.json")
     
     await browser.close()
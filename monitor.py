@@ -11,12 +11,22 @@ import os
 import sys
 import json
 import time
+import base64
+import functools
+import itertools
+import hashlib
 import random
 import logging
 import asyncio
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Dict, Optional, Set
+from collections import defaultdict
+from dataclasses import dataclass
+from urllib.parse import urlencode
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+import orjson
 
 # Maximum age for a ticket to be considered "new" (in hours)
 # Prevents spam if known_tickets.json is reset
@@ -31,17 +41,64 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '')
 TELEGRAM_CHAT_ID = os.getenv('ADMIN_CHAT_ID', '')      # العميل - إشعارات التذاكر والاشتراكات
 GROUP_CHAT_ID = os.getenv('GROUP_CHAT_ID', '')        # جروب الموظفين - نفس إشعارات العميل
 DEV_CHAT_ID = os.getenv('DEV_CHAT_ID', '')              # المطور - إشعارات النظام والأخطاء
+TELEGRAM_RATE_PER_SEC = 1.0                           # sendMessage pacing (Telegram allows ~1 msg/s per chat)
+TELEGRAM_GLOBAL_RATE = 25.0                           # bot-wide cap (Telegram allows ~30 msg/s across all chats)
+TELEGRAM_WORKERS = 8                                  # notification queue consumers per run
+TELEGRAM_MAX_CHARS = 4096                             # sendMessage text limit
+SUB_BATCH_SIZE = 20                                   # subscription changes per combined message
 SESSION_FILE = Path('browser_state.json')
+PROFILE_DIR = Path(os.getenv('PW_PROFILE_DIR', '.pw_profile'))  # persistent Chromium profile (cached between runs / container volume)
+CDP_URL = os.getenv('PLAYWRIGHT_CDP_URL', '')          # optional: reuse a long-running Chromium instead of launching one
+PROFILE_MARK = PROFILE_DIR / 'imported_state'         # fingerprint of the browser_state.json it was seeded from
+PROFILE_CACHE_BYTES = 64 * 1024 * 1024                # cap the profile's HTTP disk cache
+TOKENS_FILE = Path('session.json')                    # access_token مستخرج (extract_session.py / آخر تجديد)
 KNOWN_TICKETS_FILE = Path('known_tickets.json')
+KNOWN_TICKETS_LOG = Path('known_tickets.log')         # append-only delta on top of the JSON snapshot
+KNOWN_TICKETS_META = Path('known_tickets.meta.json') # last_run + count, rewritten every save
+LOG_COMPACT_MIN_LINES = 100                           # rewrite the snapshot once the log is this long
+KNOWN_TICKETS_MAX = 50_000                            # history cap - the API only ever returns the newest tickets
+PAGE_MAX_AGE_SECONDS = 300                            # --loop: re-open the dashboard after this long
+BROWSER_FETCH_TIMEOUT = 180                           # hard cap on one browser fetch (CDP hangs)
+LOGIN_TIMEOUT = 120                                   # hard cap on one auto-login attempt
+PAGE_RECYCLE_POLLS = 12                               # --loop: fresh page + cleared HTTP cache every N polls
 KNOWN_SUBSCRIPTIONS_FILE = Path('known_subscriptions.json')
 DASHBOARD_URL = 'https://admin.ftth.iq/dashboard'
+# Requests the monitor never needs (we only read localStorage + call the API)
+BLOCKED_RESOURCE_TYPES = ('image', 'font', 'stylesheet', 'media')
+BLOCKED_HOSTS = ('google-analytics', 'googletagmanager', 'hotjar', 'sentry')
+
+# Chromium flags: smaller RSS + faster cold start (no GPU, no background services)
+CHROMIUM_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--disable-features=Translate,BackForwardCache,MediaRouter',
+    '--js-flags=--max-old-space-size=256',
+]
 API_URL = 'https://admin.ftth.iq/api/support/tickets'
 SUBSCRIPTIONS_API_URL = 'https://admin.ftth.iq/api/subscriptions'
+# Query strings are encoded once at import - every poll reuses the same URL objects
+API_FULL_URL = f"{API_URL}?" + urlencode({
+    'pageSize': 30, 'pageNumber': 1,
+    'sortCriteria.property': 'createdAt', 'sortCriteria.direction': 'desc',
+})
+SEED_IDS_URL = f"{API_URL}?" + urlencode({      # first run: IDs only, still newest first
+    'pageSize': 100, 'pageNumber': 1, 'fields': 'displayId',
+    'sortCriteria.property': 'createdAt', 'sortCriteria.direction': 'desc',
+})
 
 # 📱 WhatsApp Business API Config
 WHATSAPP_PHONE_ID = os.getenv('WHATSAPP_PHONE_ID', '')  # Phone Number ID from Meta
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN', '')        # Permanent Access Token
 WHATSAPP_RECIPIENT = os.getenv('WHATSAPP_RECIPIENT', '')  # Recipient phone (e.g., 96477666774444)
+WHATSAPP_DIGEST_TEMPLATE = os.getenv('WHATSAPP_DIGEST_TEMPLATE', 'digest')  # approved template with one {{1}} body param
+WHATSAPP_PARAM_MAX = 1024                                 # Meta's limit for a template body parameter
 
 # 🔐 Auto-Login Credentials (from GitHub Secrets)
 FTTH_USERNAME = os.getenv('FTTH_USERNAME', '')
@@ -63,35 +120,33 @@ def load_settings_local():
     """Load settings from local file"""
     if SETTINGS_FILE.exists():
         try:
-            return json.loads(SETTINGS_FILE.read_text())
+            return orjson.loads(SETTINGS_FILE.read_bytes())
         except:
             pass
     return {k: True for k in SETTINGS_MAP.keys()}
 
 def save_settings_local(settings):
     """Save settings to local file"""
-    SETTINGS_FILE.write_text(json.dumps(settings, indent=2))
+    SETTINGS_FILE.write_bytes(orjson.dumps(settings, option=orjson.OPT_INDENT_2))
 
 async def process_pending_button_clicks():
     """
     معالجة ضغطات الأزرار المعلقة قبل بدء المراقبة
     Process any pending button clicks before starting monitoring
     """
-    import aiohttp
-    
     if not TELEGRAM_TOKEN:
         return
     
     logger.info("🔘 Checking for pending button clicks...")
     
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(json_serialize=_json_str) as session:
             # Get pending updates
             url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates"
             async with session.get(url, timeout=10) as resp:
                 if resp.status != 200:
                     return
-                data = await resp.json()
+                data = await resp.json(loads=orjson.loads)
             
             if not data.get('ok'):
                 return
@@ -156,6 +211,77 @@ async def process_pending_button_clicks():
         logger.warning(f"⚠️ Button processing error: {e}")
 
 
+def _json_str(obj) -> str:
+    """orjson-backed serializer for aiohttp's json= payloads"""
+    return orjson.dumps(obj).decode()
+
+
+async def _error_snippet(response, limit: int = 256) -> str:
+    """First `limit` bytes of an error body for the log; the connection goes straight back to the pool"""
+    try:
+        return (await response.content.read(limit)).decode('utf-8', 'replace')
+    finally:
+        response.release()
+
+
+def _atomic_write(path: Path, data: bytes):
+    """Write via a temp file + os.replace, so a crash/SIGTERM never leaves a truncated file"""
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _state_fingerprint() -> str:
+    try:
+        return hashlib.blake2b(SESSION_FILE.read_bytes(), digest_size=16).hexdigest()
+    except OSError:
+        return ''
+
+
+def _read_profile_mark() -> str:
+    try:
+        return PROFILE_MARK.read_text().strip()
+    except OSError:
+        return ''
+
+
+def _write_profile_mark():
+    """Remember which browser_state.json the profile is in sync with"""
+    try:
+        PROFILE_MARK.write_text(_state_fingerprint())
+    except OSError:
+        pass
+
+
+@functools.cache
+def _async_playwright():
+    """Playwright is imported on first use - runs served by the cached token never pay for it"""
+    from playwright.async_api import async_playwright
+    return async_playwright
+
+
+async def save_storage_state(ctx):
+    """Export cookies/localStorage to browser_state.json and mark the profile as in sync"""
+    await ctx.storage_state(path=str(SESSION_FILE))
+    _write_profile_mark()
+
+
+async def _with_backoff(action, attempts: int = 4, base: float = 0.8, cap: float = 8.0) -> bool:
+    """
+    Run `action(timeout_ms)` with exponentially growing timeouts and a full-jitter
+    pause (uniform(0, min(cap, base * 2**n))) between attempts - no synchronized retries
+    """
+    for attempt in range(attempts):
+        window = min(cap, base * 2 ** attempt)
+        try:
+            await action(int(window * 1000))
+            return True
+        except Exception:
+            if attempt < attempts - 1:
+                await asyncio.sleep(random.uniform(0, window))
+    return False
+
+
 async def auto_login(page, report_callback=None) -> bool:
     """
     تسجيل دخول تلقائي بالـ Username/Password
@@ -169,79 +295,90 @@ async def auto_login(page, report_callback=None) -> bool:
     try:
         logger.info("🔐 Auto-login starting...")
         
-        # Navigate to login page
-        await page.goto('https://admin.ftth.iq/auth/login', wait_until='networkidle', timeout=60000)
-        await asyncio.sleep(3)
+        # Angular Material selectors - each list is one CSS selector, first match wins
+        username_sel = ", ".join([
+            'input[formcontrolname="Username"]',
+            'input[formcontrolname="username"]',
+            '#mat-input-0',
+        ])
+        password_sel = ", ".join([
+            'input[formcontrolname="Password"]',
+            'input[formcontrolname="password"]',
+            '#mat-input-1',
+            'input[type="password"]',
+        ])
+        submit_sel = ", ".join([
+            'button.mat-raised-button',
+            'button.btn-xl',
+            'button:has-text("تسجيل الدخول")',
+        ])
+        login_error_sel = ", ".join([
+            'mat-error',
+            'mat-snack-bar-container',
+            '.alert-danger',
+        ])
+        
+        # Navigate to login page - DOM ready, then wake on the login form or a dashboard redirect
+        await page.goto('https://admin.ftth.iq/auth/login', wait_until='domcontentloaded', timeout=60000)
+        try:
+            await page.wait_for_function(
+                f"() => location.pathname.includes('dashboard') || !!document.querySelector({json.dumps(username_sel)})",
+                timeout=15000, polling=200
+            )
+        except Exception:
+            pass
         
         # Check if already on dashboard (session still valid)
         if 'dashboard' in page.url:
             logger.info("✅ Already logged in!")
             return True
         
-        # Angular Material selectors
-        username_selectors = [
-            'input[formcontrolname="Username"]',
-            'input[formcontrolname="username"]',
-            '#mat-input-0',
-        ]
-        
-        # Fill username
-        username_filled = False
-        for selector in username_selectors:
-            try:
-                await page.wait_for_selector(selector, state="visible", timeout=5000)
-                await page.fill(selector, FTTH_USERNAME)
-                logger.info(f"🔑 Username filled: {selector}")
-                username_filled = True
-                break
-            except:
-                continue
-        
-        if not username_filled:
+        # Fill username - short first probe, growing (jittered) retries on a slow/struggling site
+        if not await _with_backoff(
+            lambda ms: page.locator(username_sel).first.fill(FTTH_USERNAME, timeout=ms)
+        ):
             logger.error("❌ Could not find username field")
             return False
+        logger.info("🔑 Username filled")
         
         # Fill password
-        password_selectors = [
-            'input[formcontrolname="Password"]',
-            'input[formcontrolname="password"]',
-            '#mat-input-1',
-            'input[type="password"]',
-        ]
-        for selector in password_selectors:
-            try:
-                await page.fill(selector, FTTH_PASSWORD)
-                logger.info("🔑 Password filled")
-                break
-            except:
-                continue
+        try:
+            await page.locator(password_sel).first.fill(FTTH_PASSWORD, timeout=15000)
+            logger.info("🔑 Password filled")
+        except Exception:
+            pass
         
         # Submit
-        submit_selectors = [
-            'button.mat-raised-button',
-            'button.btn-xl',
-            'button:has-text("تسجيل الدخول")',
-        ]
-        for selector in submit_selectors:
-            try:
-                await page.click(selector)
-                logger.info("🔑 Form submitted")
-                break
-            except:
-                continue
+        try:
+            await page.locator(submit_sel).first.click(timeout=15000)
+            logger.info("🔑 Form submitted")
+        except Exception:
+            pass
+        
+        # Race the dashboard redirect against a login error - bad credentials fail fast instead of after 60s
+        dashboard = asyncio.create_task(page.wait_for_url('**/dashboard', timeout=60000))
+        failed = asyncio.create_task(page.locator(login_error_sel).first.wait_for(state='visible', timeout=60000))
+        done, pending = await asyncio.wait({dashboard, failed}, return_when=asyncio.FIRST_COMPLETED)
+        if dashboard not in done and failed.exception() is not None:
+            # The error probe itself gave up - keep waiting on the redirect alone
+            done, pending = await asyncio.wait({dashboard})
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
         
-        # Wait for dashboard
         try:
-            await page.wait_for_url('**/dashboard', timeout=60000)
+            if dashboard not in done:
+                raise RuntimeError("login error shown")
+            dashboard.result()
             logger.info("✅ Auto-login successful!")
             
             # Save new session
-            await page.context.storage_state(path=str(SESSION_FILE))
+            await save_storage_state(page.context)
             logger.info("💾 New session saved")
             if report_callback: report_callback("✅ Auto-login successful!")
             
             return True
-        except:
+        except Exception:
             logger.error("❌ Login failed - check credentials")
             return False
             
@@ -250,94 +387,185 @@ async def auto_login(page, report_callback=None) -> bool:
         return False
 
 
-async def browser_refresh_token(page, report_callback=None) -> bool:
+async def wait_for_token(page, timeout: int = 10000) -> Optional[str]:
+    """Wait (bounded) for the SPA to store access_token and return it from the same wait"""
+    try:
+        handle = await page.wait_for_function("() => localStorage.getItem('access_token')",
+                                              timeout=timeout, polling=200)
+        return await handle.json_value()
+    except Exception:
+        return None
+
+
+async def browser_refresh_token(page, report_callback=None) -> Optional[str]:
     """
     تجديد الـ Access Token عن طريق البراوزر
     لو الـ session انتهت، يسجل دخول تلقائي
+    Returns the fresh access_token (None on failure)
     """
     try:
         logger.info("🔄 Attempting browser-based token refresh...")
         if report_callback: report_callback("🔄 Refreshing token...")
         
         # Navigate to dashboard - this triggers the site's built-in token refresh
-        await page.goto('https://admin.ftth.iq/dashboard', wait_until='networkidle', timeout=60000)
+        # (networkidle would block on third-party beacons - DOM ready is enough)
+        await page.goto('https://admin.ftth.iq/dashboard', wait_until='domcontentloaded', timeout=60000)
         
         # ⚠️ Check if redirected to SSO login (means refresh token expired)
         current_url = page.url
         if 'sso.ftth.iq' in current_url or 'auth/login' in current_url:
             logger.warning("⚠️ Session expired - attempting auto-login...")
             
-            # 🔐 Try auto-login with credentials
-            if await auto_login(page, report_callback):
-                return True
+            # 🔐 Try auto-login with credentials (bounded - a stuck login must not pin the job)
+            try:
+                async with asyncio.timeout(LOGIN_TIMEOUT):
+                    logged_in = await auto_login(page, report_callback)
+            except TimeoutError:
+                logger.error(f"❌ Auto-login timed out after {LOGIN_TIMEOUT}s")
+                logged_in = False
+            if logged_in:
+                return await wait_for_token(page)
             else:
                 logger.error("❌ Auto-login failed!")
-                return False
-        
-        # Wait for the site's JavaScript to potentially refresh the token
-        await asyncio.sleep(5)
+                return None
         
-        # Check if we got a new token
-        new_token = await page.evaluate("localStorage.getItem('access_token')")
+        # The site's JavaScript puts the refreshed token in localStorage
+        new_token = await wait_for_token(page)
         
         if new_token:
             logger.info("✅ Browser token refresh successful!")
             if report_callback: report_callback("✅ Token refresh success")
-            return True
+            return new_token
         else:
             logger.error("❌ No token after browser refresh")
-            return False
+            return None
             
     except Exception as e:
         logger.error(f"❌ Browser refresh error: {e}")
-        return False
+        return None
 
 
-def random_delay(min_s: float, max_s: float):
-    d = random.uniform(min_s, max_s)
-    logger.info(f"⏳ Waiting {d:.0f}s...")
-    time.sleep(d)
+def jwt_exp(token: Optional[str]) -> float:
+    """Read the `exp` claim of a JWT locally (0 if missing or malformed)"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(orjson.loads(base64.urlsafe_b64decode(payload)).get('exp', 0))
+    except:
+        return 0
 
 
-def startup_delay():
+async def startup_delay():
     """تأخير عشوائي 30 ثانية - 6 دقائق (GitHub Actions فقط)"""
     if os.getenv('GITHUB_ACTIONS'):
         d = random.uniform(30, 360)  # 30 ثانية - 6 دقائق
         logger.info(f"⏳ Startup delay: {d:.0f}s")
-        time.sleep(d)
+        await asyncio.sleep(d)
 
 
 class TicketState:
+    """
+    التذاكر المعروفة: snapshot (JSON) + سجل إضافات (append-only log)
+    Each save only appends the new IDs to known_tickets.log; the full
+    snapshot is rewritten only when the log grows past a compaction threshold.
+    """
     def __init__(self):
-        self.known: Set[str] = set()
+        self.known: Dict[str, None] = {}   # ordered set: insertion order is kept across processes
+        self._dirty: list = []       # IDs added since the last save
+        self._last_run = 0.0
+        self._snapshot_size = 0
+        self._log_lines = 0
         if KNOWN_TICKETS_FILE.exists():
             try:
-                self.known = set(json.loads(KNOWN_TICKETS_FILE.read_text()).get('tickets', []))
-                logger.info(f"📂 Loaded {len(self.known)} known tickets")
+                data = orjson.loads(KNOWN_TICKETS_FILE.read_bytes())
+                self.known = dict.fromkeys(data.get('tickets', []))
+                self._last_run = data.get('last_run', 0)
+                self._snapshot_size = len(self.known)
+            except:
+                pass
+        if KNOWN_TICKETS_LOG.exists():
+            try:
+                for line in KNOWN_TICKETS_LOG.read_bytes().splitlines():
+                    self._log_lines += 1
+                    if line.startswith(b'#'):
+                        # Legacy run marker "#<timestamp>" (now kept in the meta sidecar)
+                        self._last_run = max(self._last_run, float(line[1:]))
+                    elif line:
+                        self.known[line.decode()] = None
             except:
                 pass
+        try:
+            self._last_run = max(self._last_run, orjson.loads(KNOWN_TICKETS_META.read_bytes()).get('last_run', 0))
+        except:
+            pass
+        if self.known:
+            logger.info(f"📂 Loaded {len(self.known)} known tickets")
     
     def save(self):
-        KNOWN_TICKETS_FILE.write_text(json.dumps({
+        now = datetime.now().timestamp()
+        pending = len(self._dirty)
+        if self._log_lines + pending > max(LOG_COMPACT_MIN_LINES, self._snapshot_size // 4):
+            self._compact(now)
+        elif pending:
+            with KNOWN_TICKETS_LOG.open('ab') as f:
+                f.write(b''.join(tid.encode() + b'\n' for tid in self._dirty))
+            self._log_lines += pending
+            logger.info(f"💾 Appended {pending} tickets ({len(self.known)} known)")
+        # Run timestamp lives in a tiny sidecar, so quiet polls don't grow the log
+        _atomic_write(KNOWN_TICKETS_META, orjson.dumps({'last_run': now, 'count': len(self.known)}))
+        self._dirty.clear()
+        self._last_run = now
+    
+    def _compact(self, now: float):
+        """Rewrite the full snapshot and drop the log"""
+        if len(self.known) > KNOWN_TICKETS_MAX:
+            # Oldest IDs first (insertion order) - they can no longer show up on the newest-first page
+            self.known = dict.fromkeys(itertools.islice(self.known, len(self.known) - KNOWN_TICKETS_MAX, None))
+        _atomic_write(KNOWN_TICKETS_FILE, orjson.dumps({
             'tickets': list(self.known),
-            'updated': datetime.now().isoformat(),
-            'last_run': datetime.now().timestamp(),
+            'updated': datetime.now(timezone.utc),
+            'last_run': now,
             'count': len(self.known)
-        }, indent=2))
-        logger.info(f"💾 Saved {len(self.known)} tickets")
+        }, option=orjson.OPT_UTC_Z))
+        KNOWN_TICKETS_LOG.unlink(missing_ok=True)
+        self._snapshot_size = len(self.known)
+        self._log_lines = 0
+        logger.info(f"💾 Saved {len(self.known)} tickets (compacted)")
+    
+    def seed(self, ids: Iterable[str]):
+        """First run: take the given IDs as the known set and write the snapshot directly"""
+        self.known = dict.fromkeys(ids)
+        self._dirty.clear()
+        self._last_run = datetime.now().timestamp()
+        self._compact(self._last_run)
     
     def get_last_run(self) -> float:
-        try:
-            data = json.loads(KNOWN_TICKETS_FILE.read_text())
-            return data.get('last_run', 0)
-        except:
-            return 0
+        return self._last_run
     
     def is_new(self, tid: str) -> bool:
         return tid not in self.known
     
+    def new_ids(self, tids: Iterable[str]) -> set:
+        """Bulk is_new - one C-level set difference (probes `known`, never iterates it)"""
+        return set(tids).difference(self.known)
+    
     def add(self, tid: str):
-        self.known.add(tid)
+        if tid not in self.known:
+            self.known[tid] = None
+            self._dirty.append(tid)
+    
+    def add_many(self, tids: Iterable[str]):
+        """Bulk add - one dict update instead of a per-ID add() call"""
+        fresh = [tid for tid in dict.fromkeys(tids) if tid not in self.known]
+        self.known.update(dict.fromkeys(fresh))
+        self._dirty.extend(fresh)
+
+
+# Status aliases returned by the subscriptions API (English + Arabic)
+_ACTIVE_STATUSES = frozenset(('active', 'نشط', 'جاري'))
+_EXPIRED_STATUSES = frozenset(('expired', 'منتهي', 'منتهية'))
+# alias → canonical status, so normalizing is a single dict lookup
+_STATUS_CANON = {**dict.fromkeys(_ACTIVE_STATUSES, 'active'), **dict.fromkeys(_EXPIRED_STATUSES, 'expired')}
 
 
 class SubscriptionState:
@@ -350,60 +578,211 @@ class SubscriptionState:
         self.subscriptions: Dict[str, str] = {}
         if KNOWN_SUBSCRIPTIONS_FILE.exists():
             try:
-                data = json.loads(KNOWN_SUBSCRIPTIONS_FILE.read_text())
+                data = orjson.loads(KNOWN_SUBSCRIPTIONS_FILE.read_bytes())
                 self.subscriptions = data.get('subscriptions', {})
                 logger.info(f"📂 Loaded {len(self.subscriptions)} known subscriptions")
             except:
                 pass
     
     def save(self):
-        KNOWN_SUBSCRIPTIONS_FILE.write_text(json.dumps({
+        _atomic_write(KNOWN_SUBSCRIPTIONS_FILE, orjson.dumps({
             'subscriptions': self.subscriptions,
-            'updated': datetime.now().isoformat(),
+            'updated': datetime.now(timezone.utc),
             'count': len(self.subscriptions)
-        }, indent=2, ensure_ascii=False))
+        }, option=orjson.OPT_UTC_Z))
         logger.info(f"💾 Saved {len(self.subscriptions)} subscriptions")
     
+    def begin(self, record: bool = True):
+        """
+        Start an incremental diff - update_one() stages changes until commit().
+        record=False (first run) only stages statuses, without keeping the subscription dicts
+        """
+        self._record = record
+        self.expired: list = []   # Active → Expired
+        self.renewed: list = []   # Expired → Active
+        self.new_subs: list = []  # New subscriptions
+        self._updates: Dict[str, str] = {}
+    
+    def update_one(self, sub: Dict):
+        """Diff one subscription against the stored status (nothing is applied before commit())"""
+        sub_id = sub.get('self', {}).get('id') or sub.get('id')
+        if not sub_id or sub_id in self._updates:
+            return  # pages are fetched concurrently - a row that shifted pages is reported once
+        
+        # Normalize status
+        current_status = sub.get('status', '').casefold()
+        current_status = _STATUS_CANON.get(current_status, current_status)
+        
+        old_status = self.subscriptions.get(sub_id)
+        if old_status == current_status:
+            return  # steady state - nothing to record
+        
+        self._updates[sub_id] = current_status
+        if not self._record:
+            return
+        
+        if old_status is None:
+            self.new_subs.append(sub)
+        elif old_status == 'active' and current_status == 'expired':
+            self.expired.append(sub)
+        elif old_status == 'expired' and current_status == 'active':
+            self.renewed.append(sub)
+    
+    def commit(self) -> tuple:
+        """Apply the staged statuses - Returns: (expired_list, renewed_list, new_list)"""
+        self.subscriptions.update(self._updates)
+        self._updates = {}
+        return self.expired, self.renewed, self.new_subs
+    
     def get_changes(self, current_subscriptions: list) -> tuple:
         """
         مقارنة الحالة الحالية بالمخزنة واكتشاف التغييرات
         Returns: (expired_list, renewed_list, new_list)
         """
-        expired = []   # Active → Expired
-        renewed = []   # Expired → Active
-        new_subs = []  # New subscriptions
-        
+        self.begin()
         for sub in current_subscriptions:
-            sub_id = sub.get('self', {}).get('id') or sub.get('id')
-            current_status = sub.get('status', '').lower()
-            
-            if not sub_id:
-                continue
-            
-            # Normalize status
-            if current_status in ['active', 'نشط', 'جاري']:
-                current_status = 'active'
-            elif current_status in ['expired', 'منتهي', 'منتهية']:
-                current_status = 'expired'
-            
-            old_status = self.subscriptions.get(sub_id)
-            
-            if old_status is None:
-                # New subscription
-                new_subs.append(sub)
-                self.subscriptions[sub_id] = current_status
-            elif old_status != current_status:
-                # Status changed!
-                if old_status == 'active' and current_status == 'expired':
-                    expired.append(sub)
-                elif old_status == 'expired' and current_status == 'active':
-                    renewed.append(sub)
-                self.subscriptions[sub_id] = current_status
+            self.update_one(sub)
+        return self.commit()
+
+
+# HTML escape in one pass (Telegram parse_mode=HTML)
+_ESC_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+_IQ_TZ = timezone(timedelta(hours=3))   # Asia/Baghdad, for message timestamps
+_STATUS_EMOJI = {'Open':'🔴','In Progress':'🟡','In progress':'🟡','Resolved':'🟢','Closed':'⚫'}
+
+
+@dataclass(frozen=True, slots=True)
+class Ticket:
+    """Ticket fields the notifications need - the nested API dict is walked once (hashable for lru_cache)"""
+    display_id: str
+    created_at: str
+    partner_id: str
+    partner_name: str
+    customer: str
+    phone: str
+    req_type: str
+    summary: str
+    zone: str
+    status: str
+    ticket_id: str
+    
+    @classmethod
+    def from_api(cls, t: Dict) -> 'Ticket':
+        partner = t.get('partner') or {}
+        self_ = t.get('self') or {}
+        return cls(
+            t.get('displayId', 'N/A'), t.get('createdAt', ''),
+            partner.get('id', ''), partner.get('displayValue', ''),
+            (t.get('customer') or {}).get('displayValue', ''), t.get('customerPhone', 'غير متوفر'),
+            self_.get('displayValue', ''), t.get('summary', ''),
+            (t.get('zone') or {}).get('displayValue', ''), t.get('status', 'N/A'),
+            self_.get('id', ''),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Subscription:
+    """Common subscription fields with their API fallbacks (shared by Telegram and WhatsApp)"""
+    sub_id: str
+    customer: str
+    service: str
+    expiry: str
+    zone: str
+    phone: str
+    status: str
+    
+    @classmethod
+    def from_api(cls, sub: Dict) -> 'Subscription':
+        # Service Plan Extraction (from 'services' array or 'bundle')
+        services = []
+        if isinstance(sub.get('services'), list):
+            services = [s.get('displayValue', '') for s in sub['services'] if s.get('displayValue')]
+        bundle = sub.get('bundle', {}).get('displayValue', '')
+        if services:
+            # Combine Bundle + Main Service (e.g. "FTTH Basic - FIBER 35")
+            service = f"{bundle} - {services[0]}" if bundle else services[0]
+        else:
+            service = bundle or sub.get('servicePlan', {}).get('displayValue', 'N/A')
+        
+        # Expiry Date Extraction (Correct key is 'expires')
+        expiry_raw = sub.get('expires') or sub.get('expiryDate') or sub.get('validUntil')
         
-        return expired, renewed, new_subs
+        return cls(
+            sub.get('self', {}).get('id') or sub.get('id', 'N/A'),
+            sub.get('customer', {}).get('displayValue', '') or sub.get('customerName', 'N/A'),
+            service,
+            expiry_raw[:10] if expiry_raw else 'N/A',
+            sub.get('zone', {}).get('displayValue') or sub.get('zoneName', 'N/A'),
+            sub.get('customerPhone', 'غير متوفر'),
+            sub.get('status', 'N/A'),
+        )
+
+
+class _SafeDict(dict):
+    """format_map mapping - a field the template names but the message lacks renders as N/A"""
+    def __missing__(self, key):
+        return 'N/A'
+
+
+def _esc(x) -> str:
+    return str(x).translate(_ESC_TABLE) if x else ''
+
+
+@functools.lru_cache(maxsize=1024)
+def _format_ticket(tk: Ticket) -> str:
+    """Telegram ticket message - cached, so retries/backfills reuse the built string"""
+    em = _STATUS_EMOJI.get(tk.status, '⚪')
+    ticket_time = datetime.fromisoformat(tk.created_at.replace('Z', '+00:00'))
+    formatted_time = ticket_time.astimezone(_IQ_TZ).strftime('%Y-%m-%d %H:%M:%S')
+
+    return f"""<b>🔔 تنبيه SLA جديد</b>
+━━━━━━━━━━━━━━━━━
+
+🎫 <b>رقم التذكرة:</b> {tk.display_id}
+🕐 <b>التاريخ:</b> {formatted_time}
+
+🆔 <b>معرف الوكيل:</b> {tk.partner_id}
+👤 <b>اسم الوكيل:</b> {_esc(tk.partner_name)}
+
+👥 <b>المشترك:</b> {_esc(tk.customer)}
+📱 <b>موبايل:</b> {tk.phone}
+📋 <b>نوع الطلب:</b> {_esc(tk.req_type)}
+📝 <b>الوصف:</b> {_esc(tk.summary)[:300]}
+📍 <b>المنطقة:</b> {tk.zone}
+{em} <b>الحالة:</b> {tk.status}
+
+🔗 <a href="https://admin.ftth.iq/tickets/details/{tk.ticket_id}">فتح التذكرة</a>
+━━━━━━━━━━━━━━━━━"""
+
+
+class RateLimiter:
+    """Token bucket: `rate` acquisitions per second, bursting up to `burst`"""
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
 
 
 class Telegram:
+    # Remote settings are re-read at most once a minute, not once per message
+    _settings_cache: Optional[Dict] = None
+    _settings_cache_ts = 0.0
+    _SETTINGS_TTL = 60.0
+    
     def __init__(self):
         self.token = TELEGRAM_TOKEN
         self.chat_id = TELEGRAM_CHAT_ID
@@ -411,13 +790,70 @@ class Telegram:
         self.dev_chat_id = DEV_CHAT_ID
         self.enabled = bool(self.token and self.chat_id)
         self.dev_enabled = bool(self.token and self.dev_chat_id)
+        self._session = None  # one keep-alive session for all sends (created lazily)
+        # one bucket per chat (Telegram allows ~1 msg/s each) under one bot-wide bucket
+        self._limiters: Dict[str, RateLimiter] = defaultdict(lambda: RateLimiter(TELEGRAM_RATE_PER_SEC))
+        self._global_limiter = RateLimiter(TELEGRAM_GLOBAL_RATE, burst=int(TELEGRAM_GLOBAL_RATE))
+        self._resume = asyncio.Event()  # cleared while a 429 retry_after pause is running
+        self._resume.set()
+        self._settings_lock = asyncio.Lock()
     
-    async def send(self, text: str) -> bool:
-        """Send notification to CLIENT and GROUP (tickets, subscriptions)"""
-        if not self.enabled:
-            return True
-        
-            # Load Settings (Try Remote GitHub First for Real-Time Control)
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.close()
+    
+    async def _get_session(self):
+        """Shared aiohttp session - TLS to api.telegram.org is paid once per run"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=75, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=15),
+                json_serialize=_json_str
+            )
+        return self._session
+    
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _post(self, chat_id, text: str) -> bool:
+        """sendMessage through the rate limiter - a 429 pauses every sender for retry_after"""
+        s = await self._get_session()
+        payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': True}
+        for _ in range(3):
+            await self._resume.wait()
+            await self._limiters[chat_id].acquire()
+            await self._global_limiter.acquire()
+            async with s.post(f"https://api.telegram.org/bot{self.token}/sendMessage", json=payload) as r:
+                if r.status != 429:
+                    return r.status == 200
+                try:
+                    retry_after = (await r.json(loads=orjson.loads)).get('parameters', {}).get('retry_after', 1)
+                except:
+                    retry_after = 1
+            if self._resume.is_set():
+                logger.warning(f"⏳ Telegram rate limit - pausing sends for {retry_after}s")
+                self._resume.clear()
+                await asyncio.sleep(retry_after)
+                self._resume.set()
+        return False
+    
+    async def _load_settings(self, s) -> Dict:
+        """Notification toggles - remote settings.json, cached for _SETTINGS_TTL seconds"""
+        async with self._settings_lock:  # concurrent sends share one fetch
+            if Telegram._settings_cache is not None and time.time() - Telegram._settings_cache_ts < Telegram._SETTINGS_TTL:
+                return Telegram._settings_cache
+            settings = await self._fetch_settings(s)
+            if settings:
+                Telegram._settings_cache, Telegram._settings_cache_ts = settings, time.time()
+            return settings
+    
+    async def _fetch_settings(self, s) -> Dict:
+        """Uncached read: GitHub raw first, local settings.json as fallback"""
+        # Load Settings (Try Remote GitHub First for Real-Time Control)
         settings = {}
         try:
             # 1. Try Cloud Fetch (Instant)
@@ -425,31 +861,44 @@ class Telegram:
             # Use raw.githubusercontent.com for speed. Private repos need token header? No, raw needs token in header.
             # actually API is more reliable for private repos with token.
             # Repo: Kilua-Zoldyck/awefae-fascoasdma-emkfa-zdadjkmslfcmzmds
-            
+        
             if gh_token:
                api_url = "https://raw.githubusercontent.com/Kilua-Zoldyck/awefae-fascoasdma-emkfa-zdadjkmslfcmzmds/main/settings.json"
                headers = {"Authorization": f"token {gh_token}"}
-               async with aiohttp.ClientSession() as fetch_session:
-                   async with fetch_session.get(api_url, headers=headers, timeout=5) as resp:
-                       if resp.status == 200:
-                           content = await resp.text()
-                           settings = json.loads(content)
-                           # logging.info("☁️ Cloud Settings Loaded")
-            
+               async with s.get(api_url, headers=headers, timeout=5) as resp:
+                   if resp.status == 200:
+                       settings = orjson.loads(await resp.read())
+                       # logging.info("☁️ Cloud Settings Loaded")
+        
             # 2. Fallback to Local if Cloud fails or empty
             if not settings and Path('settings.json').exists():
-                settings = json.loads(Path('settings.json').read_text())
+                settings = orjson.loads(Path('settings.json').read_bytes())
                 
         except Exception as e:
             # logging.error(f"Settings Load Error: {e}")
             # Final fallback
             if Path('settings.json').exists():
-                 try: settings = json.loads(Path('settings.json').read_text())
+                 try: settings = orjson.loads(Path('settings.json').read_bytes())
                  except: pass
-            
-        # Determine Notification Type based on text content (Simple Heuristic)
+        return settings
+    
+    async def send(self, text: str, setting: Optional[str] = None) -> bool:
+        """
+        Send notification to CLIENT and GROUP (tickets, subscriptions).
+        `setting` is the notify_* toggle that gates the group copy; without it the type is guessed from the text
+        """
+        if not self.enabled:
+            return True
+        
+        s = await self._get_session()
+        
+        settings = await self._load_settings(s)
+        
+        # Determine Notification Type - explicit toggle first, text heuristic for untagged messages
         notify_group = False
-        if "تنبيه SLA جديد" in text:
+        if setting:
+            notify_group = settings.get(setting, True)
+        elif "تنبيه SLA جديد" in text:
             notify_group = settings.get("notify_tickets", True)
         elif "اشتراك منتهي" in text:
             notify_group = settings.get("notify_expired", True)
@@ -461,20 +910,16 @@ class Telegram:
             # Default for unknown types (or fallback)
             notify_group = True
 
-        import aiohttp
         try:
-            async with aiohttp.ClientSession() as s:
-                # 1. Send to Client (Admin) - ALWAYS (Per User Request)
-                await s.post(f"https://api.telegram.org/bot{self.token}/sendMessage",
-                    json={'chat_id': self.chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': True}
-                )
-                
-                # 2. Send to Group (Employees) - ONLY IF ENABLED in settings
-                if self.group_chat_id and notify_group:
-                     await s.post(f"https://api.telegram.org/bot{self.token}/sendMessage",
-                        json={'chat_id': self.group_chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': True}
-                    )
-                return True
+            # 1. Client (Admin) - ALWAYS (Per User Request)
+            # 2. Group (Employees) - ONLY IF ENABLED in settings
+            # Independent chats, so both posts are in flight together
+            posts = [self._post(self.chat_id, text)]
+            if self.group_chat_id and notify_group:
+                posts.append(self._post(self.group_chat_id, text))
+            results = await asyncio.gather(*posts, return_exceptions=True)
+            # Delivery is judged by the admin post - the group copy is best-effort
+            return results[0] is True
         except:
             return False
     
@@ -482,145 +927,83 @@ class Telegram:
         """Send notification to DEVELOPER only (system errors, session expired)"""
         if not self.dev_enabled:
             return True
-        import aiohttp
         try:
-            async with aiohttp.ClientSession() as s:
-                async with s.post(f"https://api.telegram.org/bot{self.token}/sendMessage",
-                    json={'chat_id': self.dev_chat_id, 'text': text, 'parse_mode': 'HTML', 'disable_web_page_preview': True}
-                ) as r:
-                    return r.status == 200
+            return await self._post(self.dev_chat_id, text)
         except:
             return False
     
-    async def send_to_all(self, text: str) -> bool:
+    async def send_to_all(self, text: str, setting: Optional[str] = None) -> bool:
         """Send notification to BOTH client AND developer (monitoring alerts)"""
-        # Send to client
-        await self.send(text)
-        # Also send to developer
-        await self.send_to_dev(text)
+        # Client/group and developer in parallel - one failing chat doesn't hold up the other
+        await asyncio.gather(self.send(text, setting), self.send_to_dev(text), return_exceptions=True)
         return True
     
     def format(self, t: Dict) -> str:
-        def e(x): return str(x).replace('&','&amp;').replace('<','&lt;').replace('>','&gt;') if x else ''
-        st = t.get('status', 'N/A')
-        em = {'Open':'🔴','In Progress':'🟡','In progress':'🟡','Resolved':'🟢','Closed':'⚫'}.get(st,'⚪')
-        ticket_time = datetime.fromisoformat(t.get('createdAt', '').replace('Z', '+00:00'))
-        local_time = ticket_time.astimezone(timezone(timedelta(hours=3)))
-        formatted_time = local_time.strftime('%Y-%m-%d %H:%M:%S')
-
-        return f"""<b>🔔 تنبيه SLA جديد</b>
-━━━━━━━━━━━━━━━━━
-
-🎫 <b>رقم التذكرة:</b> {t.get('displayId', 'N/A')}
-🕐 <b>التاريخ:</b> {formatted_time}
-
-🆔 <b>معرف الوكيل:</b> {t.get('partner', {}).get('id', '')}
-👤 <b>اسم الوكيل:</b> {e(t.get('partner', {}).get('displayValue', ''))}
-
-👥 <b>المشترك:</b> {e(t.get('customer', {}).get('displayValue', ''))}
-📱 <b>موبايل:</b> {t.get('customerPhone', 'غير متوفر')}
-📋 <b>نوع الطلب:</b> {e(t.get('self', {}).get('displayValue', ''))}
-📝 <b>الوصف:</b> {e(t.get('summary', ''))[:300]}
-📍 <b>المنطقة:</b> {t.get('zone', {}).get('displayValue', '')}
-{em} <b>الحالة:</b> {st}
-
-🔗 <a href="https://admin.ftth.iq/tickets/details/{t.get('self', {}).get('id', '')}">فتح التذكرة</a>
+        """Thin adapter - the cached _format_ticket does the escaping and assembly"""
+        return _format_ticket(Ticket.from_api(t))
+
+    # Subscription message skeletons - built once, filled with format_map per message
+    _SUB_FIELDS = """🆔 <b>رمز الاشتراك:</b> {sub_id}
+👤 <b>المشترك:</b> {customer}
+📱 <b>موبايل:</b> {phone}
+📦 <b>الخدمة:</b> {service}
+📅 <b>{expiry_label}:</b> {expiry}
+📍 <b>المنطقة:</b> {zone}
+"""
+    _SUB_FOOTER = """
+🔗 <a href="https://admin.ftth.iq/subscriptions">فتح الاشتراكات</a>
 ━━━━━━━━━━━━━━━━━"""
+    _EXPIRED_TEMPLATE = "<b>🔴 اشتراك منتهي</b>\n━━━━━━━━━━━━━━━━━\n\n" + _SUB_FIELDS + \
+        "\n⚠️ <b>الحالة:</b> منتهي الصلاحية\n" + _SUB_FOOTER
+    _RENEWED_TEMPLATE = "<b>🟢 تم التجديد</b>\n━━━━━━━━━━━━━━━━━\n\n" + _SUB_FIELDS + \
+        "\n✅ <b>الحالة:</b> تم التجديد بنجاح\n" + _SUB_FOOTER
+    _NEW_SUB_TEMPLATE = "<b>🆕 مشترك جديد</b>\n━━━━━━━━━━━━━━━━━\n\n" + _SUB_FIELDS + \
+        "{status_emoji} <b>الحالة:</b> {status}\n\n📢 <b>تمت إضافته للمراقبة</b>\n" + _SUB_FOOTER
     
-    def _extract_common_data(self, sub: Dict) -> Dict:
-        """Helper to extract common subscription fields with fallbacks"""
-        data = {}
-        data['sub_id'] = sub.get('self', {}).get('id') or sub.get('id', 'N/A')
-        data['customer'] = sub.get('customer', {}).get('displayValue', '') or sub.get('customerName', 'N/A')
-        
-        # Service Plan Extraction (from 'services' array or 'bundle')
-        services = []
-        if 'services' in sub and isinstance(sub['services'], list):
-            services = [s.get('displayValue', '') for s in sub['services'] if s.get('displayValue')]
-        
-        bundle = sub.get('bundle', {}).get('displayValue', '')
-        
-        if services:
-            # Combine Bundle + Main Service (e.g. "FTTH Basic - FIBER 35")
-            main_service = services[0] 
-            data['service'] = f"{bundle} - {main_service}" if bundle else main_service
-        else:
-            data['service'] = bundle or sub.get('servicePlan', {}).get('displayValue', 'N/A')
-        
-        # Expiry Date Extraction (Correct key is 'expires')
-        expiry_raw = (
-            sub.get('expires') or 
-            sub.get('expiryDate') or 
-            sub.get('validUntil')
+    @staticmethod
+    def _sub_fields(d: Subscription, expiry_label: str) -> '_SafeDict':
+        return _SafeDict(
+            sub_id=_esc(d.sub_id), customer=_esc(d.customer), phone=d.phone,
+            service=_esc(d.service), expiry_label=expiry_label, expiry=d.expiry, zone=_esc(d.zone),
         )
-        data['expiry'] = expiry_raw[:10] if expiry_raw else 'N/A'
-        
-        data['zone'] = sub.get('zone', {}).get('displayValue') or sub.get('zoneName', 'N/A')
-        data['phone'] = sub.get('customerPhone', 'غير متوفر')
-        return data
-
-    def format_expired(self, sub: Dict) -> str:
+    
+    _BATCH_TITLES = {
+        'expired': '🔴 اشتراكات منتهية',
+        'renewed': '🟢 اشتراكات مجددة',
+        'new': '🆕 مشتركين جدد',
+    }
+    
+    def format_batch(self, kind: str, subs: List[Subscription]) -> list:
+        """Same-kind changes as list messages (≤ SUB_BATCH_SIZE entries and ≤ 4096 chars each)"""
+        head = f"<b>{self._BATCH_TITLES[kind]}</b> ({len(subs)})\n━━━━━━━━━━━━━━━━━\n"
+        room = TELEGRAM_MAX_CHARS - len(head) - len(self._SUB_FOOTER)
+        messages, lines, size = [], [], 0
+        for d in subs:
+            line = (f"\n🆔 <b>{_esc(d.sub_id)}</b> | 👤 {_esc(d.customer)}\n"
+                    f"📱 {d.phone} | 📦 {_esc(d.service)} | 📅 {d.expiry}\n")
+            if lines and (len(lines) >= SUB_BATCH_SIZE or size + len(line) > room):
+                messages.append(head + ''.join(lines) + self._SUB_FOOTER)
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line)
+        if lines:
+            messages.append(head + ''.join(lines) + self._SUB_FOOTER)
+        return messages
+    
+    def format_expired(self, d: Subscription) -> str:
         """Format expired subscription notification"""
-        def e(x): return str(x).replace('&','&amp;').replace('<','&lt;').replace('>','&gt;') if x else ''
-        d = self._extract_common_data(sub)
-        
-        return f"""<b>🔴 اشتراك منتهي</b>
-━━━━━━━━━━━━━━━━━
-
-🆔 <b>رمز الاشتراك:</b> {e(d['sub_id'])}
-👤 <b>المشترك:</b> {e(d['customer'])}
-📱 <b>موبايل:</b> {d['phone']}
-📦 <b>الخدمة:</b> {e(d['service'])}
-📅 <b>تاريخ الانتهاء:</b> {d['expiry']}
-📍 <b>المنطقة:</b> {e(d['zone'])}
-
-⚠️ <b>الحالة:</b> منتهي الصلاحية
-
-🔗 <a href="https://admin.ftth.iq/subscriptions">فتح الاشتراكات</a>
-━━━━━━━━━━━━━━━━━"""
+        return self._EXPIRED_TEMPLATE.format_map(self._sub_fields(d, 'تاريخ الانتهاء'))
     
-    def format_renewed(self, sub: Dict) -> str:
+    def format_renewed(self, d: Subscription) -> str:
         """Format renewed subscription notification"""
-        def e(x): return str(x).replace('&','&amp;').replace('<','&lt;').replace('>','&gt;') if x else ''
-        d = self._extract_common_data(sub)
-        
-        return f"""<b>🟢 تم التجديد</b>
-━━━━━━━━━━━━━━━━━
-
-🆔 <b>رمز الاشتراك:</b> {e(d['sub_id'])}
-👤 <b>المشترك:</b> {e(d['customer'])}
-📱 <b>موبايل:</b> {d['phone']}
-📦 <b>الخدمة:</b> {e(d['service'])}
-📅 <b>صالح حتى:</b> {d['expiry']}
-📍 <b>المنطقة:</b> {e(d['zone'])}
-
-✅ <b>الحالة:</b> تم التجديد بنجاح
-
-🔗 <a href="https://admin.ftth.iq/subscriptions">فتح الاشتراكات</a>
-━━━━━━━━━━━━━━━━━"""
+        return self._RENEWED_TEMPLATE.format_map(self._sub_fields(d, 'صالح حتى'))
     
-    def format_new_subscriber(self, sub: Dict) -> str:
+    def format_new_subscriber(self, d: Subscription) -> str:
         """Format new subscriber notification"""
-        def e(x): return str(x).replace('&','&amp;').replace('<','&lt;').replace('>','&gt;') if x else ''
-        d = self._extract_common_data(sub)
-        status = sub.get('status', 'N/A')
-        status_emoji = "🟢" if status.lower() in ['active', 'نشط', 'جاري'] else "🔴"
-        
-        return f"""<b>🆕 مشترك جديد</b>
-━━━━━━━━━━━━━━━━━
-
-🆔 <b>رمز الاشتراك:</b> {e(d['sub_id'])}
-👤 <b>المشترك:</b> {e(d['customer'])}
-📱 <b>موبايل:</b> {d['phone']}
-📦 <b>الخدمة:</b> {e(d['service'])}
-📅 <b>صالح حتى:</b> {d['expiry']}
-📍 <b>المنطقة:</b> {e(d['zone'])}
-{status_emoji} <b>الحالة:</b> {status}
-
-📢 <b>تمت إضافته للمراقبة</b>
-
-🔗 <a href="https://admin.ftth.iq/subscriptions">فتح الاشتراكات</a>
-━━━━━━━━━━━━━━━━━"""
+        fields = self._sub_fields(d, 'صالح حتى')
+        fields['status'] = d.status
+        fields['status_emoji'] = "🟢" if d.status.casefold() in _ACTIVE_STATUSES else "🔴"
+        return self._NEW_SUB_TEMPLATE.format_map(fields)
 
 
 class WhatsApp:
@@ -630,23 +1013,34 @@ class WhatsApp:
         self.token = WHATSAPP_TOKEN
         self.recipient = WHATSAPP_RECIPIENT
         self.enabled = bool(self.phone_id and self.token and self.recipient)
+        self._session = None  # shared keep-alive session to graph.facebook.com (created lazily)
         if self.enabled:
             logger.info("📱 WhatsApp notifications enabled")
     
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10),
+                headers={"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"},
+                json_serialize=_json_str
+            )
+        return self._session
+    
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
     async def send(self, text: str) -> bool:
         """Send a text message via WhatsApp Business API"""
         if not self.enabled:
             return True
         
-        import aiohttp
         try:
             # First, we need to use a template message since we're outside the 24h window
             # Using hello_world template for now - you can create custom template later
             url = f"https://graph.facebook.com/v22.0/{self.phone_id}/messages"
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json"
-            }
             
             # Send text message (Requires active 24h conversation window for simple text)
             # User must message the bot first!
@@ -657,15 +1051,15 @@ class WhatsApp:
                 "text": {"body": text}
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        logger.info("📱 WhatsApp notification sent!")
-                        return True
-                    else:
-                        error = await response.text()
-                        logger.warning(f"⚠️ WhatsApp error: {response.status} - {error}")
-                        return False
+            session = await self._get_session()
+            async with session.post(url, json=payload) as response:
+                if response.status == 200:
+                    logger.info("📱 WhatsApp notification sent!")
+                    return True
+                else:
+                    error = await _error_snippet(response)
+                    logger.warning(f"⚠️ WhatsApp error: {response.status} - {error}")
+                    return False
         except Exception as e:
             logger.warning(f"⚠️ WhatsApp send error: {e}")
             return False
@@ -681,38 +1075,33 @@ class WhatsApp:
     
     def format(self, t: Dict) -> str:
         """Format ticket for WhatsApp (plain text, no HTML)"""
-        st = t.get('status', 'N/A')
-        em = {'Open':'🔴','In Progress':'🟡','In progress':'🟡','Resolved':'🟢','Closed':'⚫'}.get(st,'⚪')
+        tk = Ticket.from_api(t)
+        em = _STATUS_EMOJI.get(tk.status, '⚪')
         return f"""🔔 *تنبيه SLA جديد*
 ━━━━━━━━━━━━━━━━━
 
-🎫 *رقم التذكرة:* {t.get('displayId', 'N/A')}
-🕐 *التاريخ:* {t.get('createdAt', '')[:19].replace('T', ' ')}
+🎫 *رقم التذكرة:* {tk.display_id}
+🕐 *التاريخ:* {tk.created_at[:19].replace('T', ' ')}
 
-🆔 *معرف الوكيل:* {t.get('partner', {}).get('id', '')}
-👤 *اسم الوكيل:* {t.get('partner', {}).get('displayValue', '')}
+🆔 *معرف الوكيل:* {tk.partner_id}
+👤 *اسم الوكيل:* {tk.partner_name}
 
-👥 *المشترك:* {t.get('customer', {}).get('displayValue', '')}
-📱 *موبايل:* {t.get('customerPhone', 'غير متوفر')}
-📋 *نوع الطلب:* {t.get('self', {}).get('displayValue', '')}
-📝 *الوصف:* {t.get('summary', '')[:300]}
-📍 *المنطقة:* {t.get('zone', {}).get('displayValue', '')}
-{em} *الحالة:* {st}
+👥 *المشترك:* {tk.customer}
+📱 *موبايل:* {tk.phone}
+📋 *نوع الطلب:* {tk.req_type}
+📝 *الوصف:* {tk.summary[:300]}
+📍 *المنطقة:* {tk.zone}
+{em} *الحالة:* {tk.status}
 
-🔗 https://admin.ftth.iq/tickets/details/{t.get('self', {}).get('id', '')}
+🔗 https://admin.ftth.iq/tickets/details/{tk.ticket_id}
 ━━━━━━━━━━━━━━━━━"""
 
     async def send_template(self, template_name: str, variable_text: str) -> bool:
         """Send a template message (required for notifications > 24h)"""
         if not self.enabled:
             return True
-        import aiohttp
         try:
             url = f"https://graph.facebook.com/v22.0/{self.phone_id}/messages"
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Content-Type": "application/json"
-            }
             
             payload = {
                 "messaging_product": "whatsapp",
@@ -735,40 +1124,42 @@ class WhatsApp:
                 }
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        logger.info(f"📱 WhatsApp Template '{template_name}' sent!")
-                        return True
-                    else:
-                        error = await response.text()
-                        logger.warning(f"⚠️ WhatsApp Template error: {response.status} - {error}")
-                        return False
+            session = await self._get_session()
+            async with session.post(url, json=payload) as response:
+                if response.status == 200:
+                    logger.info(f"📱 WhatsApp Template '{template_name}' sent!")
+                    return True
+                else:
+                    error = await _error_snippet(response)
+                    logger.warning(f"⚠️ WhatsApp Template error: {response.status} - {error}")
+                    return False
         except Exception as e:
             logger.warning(f"⚠️ WhatsApp send error: {e}")
             return False
 
-    def format_simple(self, sub: Dict) -> str:
+    async def flush(self, messages: list) -> bool:
+        """Send buffered notifications as `digest` template messages, one POST per 1024-char chunk"""
+        if not self.enabled or not messages:
+            return True
+        sep = ' ━━ '
+        chunks, cur = [], ''
+        for m in messages:
+            # Template parameters may not contain newlines/tabs or long runs of spaces
+            part = ' '.join(m.split())[:WHATSAPP_PARAM_MAX]
+            if cur and len(cur) + len(sep) + len(part) > WHATSAPP_PARAM_MAX:
+                chunks.append(cur)
+                cur = part
+            else:
+                cur = f"{cur}{sep}{part}" if cur else part
+        if cur:
+            chunks.append(cur)
+        logger.info(f"📱 WhatsApp digest: {len(messages)} items in {len(chunks)} message(s)")
+        sent = [await self.send_template(WHATSAPP_DIGEST_TEMPLATE, c) for c in chunks]
+        return all(sent)
+
+    def format_simple(self, d: Subscription) -> str:
         """Simple format for batched messages"""
-        data = self._extract_common_data(sub) # Helper needs to be available or duplicated
-        return f"🆔 {data['sub_id']} | 👤 {data['customer']} | 📱 {data.get('phone', 'N/A')} | 📦 {data['service']}"
-
-    # Helper to extract common data (duplicated from Telegram class to keep classes independent)
-    def _extract_common_data(self, sub: Dict) -> Dict:
-        data = {}
-        data['sub_id'] = sub.get('self', {}).get('id') or sub.get('id', 'N/A')
-        data['customer'] = sub.get('customer', {}).get('displayValue', '') or sub.get('customerName', 'N/A')
-        services = []
-        if 'services' in sub and isinstance(sub['services'], list):
-            services = [s.get('displayValue', '') for s in sub['services'] if s.get('displayValue')]
-        bundle = sub.get('bundle', {}).get('displayValue', '')
-        if services:
-            main_service = services[0] 
-            data['service'] = f"{bundle} - {main_service}" if bundle else main_service
-        else:
-            data['service'] = bundle or sub.get('servicePlan', {}).get('displayValue', 'N/A')
-        data['phone'] = sub.get('customerPhone', 'غير متوفر')
-        return data
+        return f"🆔 {d.sub_id} | 👤 {d.customer} | 📱 {d.phone} | 📦 {d.service}"
 
 
 class Monitor:
@@ -782,19 +1173,50 @@ class Monitor:
         self.page = None
         self.report_buffer = []
         self.whatsapp_buffer = [] # Buffer for periodic WhatsApp updates
-
+        self._http = None   # aiohttp session for direct API calls (keep-alive)
+        self._token = self._load_cached_token()
+        self.keep_alive = False    # --loop mode: keep the browser open between polls
+        self._page_ready = False   # page already sitting on the dashboard
+        self._last_goto = 0.0
+        self._last_token_hash = None   # token behind the last storage_state save
+        self._mark_after_load = False  # imported state not written to the profile until a dashboard load
+        self._save_pending = asyncio.Event()   # state files waiting for the background saver
+        self._dirty_states: list = []
+        self._saver_task: Optional[asyncio.Task] = None
+
+    def _mark_dirty(self, state):
+        """Queue a state object's save() for the background saver (repeat marks coalesce)"""
+        if state not in self._dirty_states:
+            self._dirty_states.append(state)
+        self._save_pending.set()
+    
+    async def _saver_loop(self):
+        """Run queued saves in a worker thread so file writes never stall sends / pagination"""
+        while True:
+            await self._save_pending.wait()
+            self._save_pending.clear()
+            while self._dirty_states:
+                state = self._dirty_states.pop(0)
+                try:
+                    await asyncio.to_thread(state.save)
+                except Exception as e:
+                    logger.error(f"❌ State save error: {e}")
+            if self._saver_task is None:
+                return  # stop requested and nothing left to write
+    
+    async def _stop_saver(self):
+        """Flush pending saves and end the saver loop"""
+        task, self._saver_task = self._saver_task, None
+        if task:
+            self._save_pending.set()
+            await task
+    
     def log_report(self, msg: str):
         """Add message to execution report"""
         self.report_buffer.append(msg)
     
     async def setup(self):
-        from playwright.async_api import async_playwright
-        
-        self.pw = await async_playwright().start()
-        self.browser = await self.pw.chromium.launch(
-            headless=True,
-            args=['--disable-blink-features=AutomationControlled', '--no-sandbox']
-        )
+        self.pw = await _async_playwright()().start()
         
         vp = random.choice([
             {'width': 1920, 'height': 1080},
@@ -802,47 +1224,193 @@ class Monitor:
             {'width': 1536, 'height': 864},
         ])
         
-        # Create context with session if exists, otherwise empty
+        # Persistent profile: HTTP cache (JS bundles), HSTS and TLS tickets survive between runs
         ctx_args = {
             'viewport': vp,
             'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36',
             'locale': 'ar-IQ',
             'timezone_id': 'Asia/Baghdad',
         }
+        if CDP_URL:
+            # Externally managed Chromium (must run with --keep-alive): its default
+            # context keeps localStorage/cookies warm across our runs
+            self.browser = await self.pw.chromium.connect_over_cdp(CDP_URL)
+            self.ctx = (self.browser.contexts[0] if self.browser.contexts
+                        else await self.browser.new_context(**ctx_args))
+            PROFILE_DIR.mkdir(exist_ok=True)  # still holds the import mark for browser_state.json
+            logger.info("🔌 Connected to Chromium over CDP")
+        else:
+            self.ctx = await self.pw.chromium.launch_persistent_context(
+                str(PROFILE_DIR),
+                headless=True,
+                args=CHROMIUM_ARGS + [f'--disk-cache-size={PROFILE_CACHE_BYTES}'],
+                chromium_sandbox=False,
+                **ctx_args,
+            )
         
+        # Seed the profile from browser_state.json when it is empty, or when the
+        # file was replaced (e.g. a fresh session uploaded from extract_session.py)
         if SESSION_FILE.exists():
-            ctx_args['storage_state'] = str(SESSION_FILE)
-            logger.info("📂 Using existing session")
-            self.log_report("📂 Session: Found existing file")
-        else:
+            if _state_fingerprint() != _read_profile_mark():
+                await self._import_storage_state()
+                logger.info("📂 Session imported into browser profile")
+                self.log_report("📂 Session: Imported file into profile")
+            else:
+                logger.info("📂 Using existing browser profile")
+                self.log_report("📂 Session: Profile up to date")
+        elif not PROFILE_MARK.exists():
             logger.warning("⚠️ No session file - will need to auto-login")
             self.log_report("⚠️ Session: No file, new login needed")
         
-        self.ctx = await self.browser.new_context(**ctx_args)
-        self.page = await self.ctx.new_page()
-        await self.page.add_init_script("Object.defineProperty(navigator,'webdriver',{get:()=>undefined})")
+        await self.ctx.add_init_script("Object.defineProperty(navigator,'webdriver',{get:()=>undefined})")
+        
+        # 🚫 Skip images/fonts/css/trackers - faster dashboard load
+        #    (on the context, so every page - including login popups/new tabs - is covered)
+        async def _block(route, req):
+            if req.resource_type in BLOCKED_RESOURCE_TYPES or any(h in req.url for h in BLOCKED_HOSTS):
+                await route.abort()
+            else:
+                await route.continue_()
+        await self.ctx.route("**/*", _block)
+        
+        self.page = self.ctx.pages[0] if self.ctx.pages else await self.ctx.new_page()
         
         logger.info(f"✅ Browser ready ({vp['width']}x{vp['height']})")
         return True
     
+    async def _import_storage_state(self):
+        """Load cookies + localStorage from browser_state.json into the persistent profile"""
+        state = orjson.loads(SESSION_FILE.read_bytes())
+        if state.get('cookies'):
+            await self.ctx.add_cookies(state['cookies'])
+        # Applied once per imported file (flag in the profile's localStorage, not per tab) -
+        # recycled pages must not write the old tokens over ones the site has refreshed since
+        mark = json.dumps(_state_fingerprint())
+        for origin in state.get('origins', []):
+            items = {i['name']: i['value'] for i in origin.get('localStorage', [])}
+            await self.ctx.add_init_script(script=f"""
+                if (location.origin === {json.dumps(origin['origin'])} && localStorage.getItem('__seeded') !== {mark}) {{
+                    for (const [k, v] of Object.entries({json.dumps(items)})) localStorage.setItem(k, v);
+                    localStorage.setItem('__seeded', {mark});
+                }}
+            """)
+        # The init script only runs on navigation - mark the profile once a dashboard load succeeds
+        self._mark_after_load = True
+    
+    def _load_cached_token(self) -> Optional[str]:
+        """Read the last known access_token from session.json (no browser needed)"""
+        try:
+            data = orjson.loads(TOKENS_FILE.read_bytes())
+        except:
+            return None
+        token = data.get('access_token') or None
+        exp = data.get('exp') or jwt_exp(token)
+        if exp <= time.time() + 60:
+            # Expired (or about to) - the browser path will fetch a fresh one
+            return None
+        logger.info(f"🔑 Cached token valid for {(exp - time.time()) / 60:.0f} more min")
+        return token
+    
+    def _remember_token(self, token: Optional[str]):
+        """Cache a fresh access_token in memory and in session.json for the next run"""
+        if not token or token == self._token:
+            return
+        self._token = token
+        try:
+            data = orjson.loads(TOKENS_FILE.read_bytes()) if TOKENS_FILE.exists() else {}
+        except:
+            data = {}
+        data.update({'access_token': token, 'exp': jwt_exp(token), 'saved_at': datetime.now(timezone.utc)})
+        _atomic_write(TOKENS_FILE, orjson.dumps(data, option=orjson.OPT_UTC_Z))
+        logger.info("💾 Access token cached")
+    
+    @staticmethod
+    def _auth_headers(token: Optional[str]) -> Dict:
+        return {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+    
+    async def _api_get(self, url: str, token: Optional[str] = None) -> Dict:
+        """
+        GET مباشر للـ API بدون البراوزر
+        Direct HTTP GET with a Bearer token (default: the cached one) - returns JSON or {'error': ...}
+        """
+        token = token or self._token
+        # exp is checked locally - an expired token would only earn a 401 round-trip
+        if jwt_exp(token) <= time.time() + 60:
+            return {'error': 'no_token'}
+        if self._http is None or self._http.closed:
+            # Sized for the concurrent subscription pages + phone lookups, all to admin.ftth.iq
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, keepalive_timeout=60, ttl_dns_cache=300)
+            )
+        try:
+            async with self._http.get(url, headers=self._auth_headers(token),
+                                      timeout=aiohttp.ClientTimeout(total=60)) as r:
+                if r.status != 200:
+                    return {'error': r.status}
+                # Raw bytes straight into orjson - no str decode / content-type sniffing in between
+                return orjson.loads(await r.read())
+        except Exception as e:
+            return {'error': str(e)}
+    
+    async def _fetch_api_http(self, url: str) -> Optional[Dict]:
+        """Fast path: fetch tickets over plain HTTP using the cached token"""
+        result = await self._api_get(url)
+        if 'error' in result:
+            logger.info(f"⚡ Direct API unavailable ({result['error']}) - falling back to browser")
+            return result
+        logger.info(f"⚡ Got {len(result.get('items',[]))} tickets (direct API)")
+        self.log_report("⚡ Fetch: direct API (no browser)")
+        return result
+    
+    async def _refresh_session(self) -> bool:
+        """Fallback: start Playwright, refresh the token in the browser and cache it"""
+        if not self.page and not await self.setup():
+            return False
+        # The page may already hold a newer, unexpired token - no refresh round needed then
+        try:
+            token = await self.page.evaluate("localStorage.getItem('access_token')")
+        except:
+            token = None
+        if token and token != self._token and jwt_exp(token) > time.time() + 60:
+            self._remember_token(token)
+            return True
+        token = await browser_refresh_token(self.page, self.log_report)
+        if not token:
+            return False
+        if self._mark_after_load:
+            _write_profile_mark()
+            self._mark_after_load = False
+        try:
+            await save_storage_state(self.ctx)
+        except:
+            pass
+        self._remember_token(token)
+        return bool(self._token)
+    
+    async def _send_all(self, messages: Iterable[tuple]):
+        """
+        Drain (text, notify_* setting) pairs through a fixed worker pool
+        (pacing is left to Telegram's rate limiters)
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in messages:
+            queue.put_nowait(item)
+        
+        async def worker():
+            while not queue.empty():
+                msg, setting = queue.get_nowait()
+                try:
+                    await self.telegram.send_to_all(msg, setting)
+                except Exception as e:
+                    logger.error(f"❌ Telegram send error: {e}")
+        
+        await asyncio.gather(*(worker() for _ in range(min(TELEGRAM_WORKERS, queue.qsize()))))
+    
     async def get_customer_phone(self, customer_id: str) -> Optional[str]:
         """Fetch customer phone number from ID"""
         try:
             # Quick fetch from API
-            result = await self.page.evaluate(f"""
-                (async()=>{{
-                    try{{
-                        let token = localStorage.getItem('access_token');
-                        if (!token) return {{error:'no_token'}};
-                        
-                        let r = await fetch('https://admin.ftth.iq/api/customers/{customer_id}',{{
-                            headers:{{'Authorization':'Bearer '+token,'Accept':'application/json'}}
-                        }});
-                        
-                        return r.ok ? await r.json() : {{error:r.status}};
-                    }}catch(e){{return {{error:e.message}};}}
-                }})()
-            """)
+            result = await self._api_get(f'https://admin.ftth.iq/api/customers/{customer_id}')
             
             if result and 'model' in result:
                 return result.get('model', {}).get('primaryContact', {}).get('mobile')
@@ -852,53 +1420,59 @@ class Monitor:
             logger.error(f"❌ Phone fetch error: {e}")
             return None
 
-    async def _fetch_api(self) -> Optional[Dict]:
+    async def _fetch_api(self, url: str) -> Optional[Dict]:
         """Internal API fetch - does NOT retry"""
         try:
-            await self.page.goto(DASHBOARD_URL, wait_until='domcontentloaded', timeout=120000)
-            
-            if 'sso.ftth.iq' in self.page.url:
-                logger.error("❌ Session expired!")
-                return None
+            # Re-navigate only on the first poll, after an SSO redirect, or when the page is stale
+            stale = time.monotonic() - self._last_goto > PAGE_MAX_AGE_SECONDS
+            if not self._page_ready or 'sso.ftth.iq' in self.page.url or stale:
+                await self.page.goto(DASHBOARD_URL, wait_until='domcontentloaded', timeout=120000)
+                self._last_goto = time.monotonic()
+                
+                if 'sso.ftth.iq' in self.page.url:
+                    logger.error("❌ Session expired!")
+                    self._page_ready = False
+                    return None
+                
+                self._page_ready = True
+                if self._mark_after_load:
+                    _write_profile_mark()
+                    self._mark_after_load = False
+                # Wait for the site to set a token - skipped while the last one is still valid
+                if jwt_exp(self._token) <= time.time() + 60:
+                    try:
+                        await self.page.wait_for_function(
+                            "() => !!localStorage.getItem('access_token')",
+                            timeout=30000, polling=200
+                        )
+                    except Exception:
+                        pass
             
-            # Wait for site to auto-refresh token if needed
-            await asyncio.sleep(3)
-            random_delay(2, 4)
+            # The browser only supplies the token - the GET itself goes over the keep-alive aiohttp session
+            # Fall back to the cached token explicitly so the one we hash/store is the one that was sent
+            token = await self.page.evaluate("localStorage.getItem('access_token')") or self._token
+            result = await self._api_get(url, token)
             
-            result = await self.page.evaluate(f"""
-                (async()=>{{
-                    try{{
-                        let token = localStorage.getItem('access_token');
-                        if (!token) return {{error:'no_token'}};
-                        
-                        let r = await fetch('{API_URL}?pageSize=30&pageNumber=1&sortCriteria.property=createdAt&sortCriteria.direction=desc',{{
-                            headers:{{'Authorization':'Bearer '+token,'Accept':'application/json'}}
-                        }});
-                        
-                        // Retry once if 401
-                        if (r.status === 401) {{
-                            await new Promise(x=>setTimeout(x,2000));
-                            token = localStorage.getItem('access_token');
-                            r = await fetch('{API_URL}?pageSize=30&pageNumber=1&sortCriteria.property=createdAt&sortCriteria.direction=desc',{{
-                                headers:{{'Authorization':'Bearer '+token,'Accept':'application/json'}}
-                            }});
-                        }}
-                        
-                        return r.ok ? await r.json() : {{error:r.status}};
-                    }}catch(e){{return {{error:e.message}};}}
-                }})()
-            """)
+            # Retry once if 401 (the site may have refreshed the token meanwhile)
+            if result.get('error') == 401:
+                await asyncio.sleep(2)
+                token = await self.page.evaluate("localStorage.getItem('access_token')") or self._token
+                result = await self._api_get(url, token)
             
             if 'error' in result:
                 logger.error(f"❌ API: {result['error']}")
                 # Token errors are handled by the fetch() wrapper
                 return result
             
-            # Save updated session (tokens may have refreshed)
-            try:
-                await self.ctx.storage_state(path=str(SESSION_FILE))
-            except:
-                pass
+            # Save updated session only when the token actually changed
+            token_hash = hashlib.blake2b(token.encode(), digest_size=16).digest()
+            if token_hash != self._last_token_hash:
+                try:
+                    await save_storage_state(self.ctx)
+                    self._last_token_hash = token_hash
+                except Exception:
+                    pass
+            self._remember_token(token)
             
             logger.info(f"✅ Got {len(result.get('items',[]))} tickets")
             return result
@@ -907,9 +1481,27 @@ class Monitor:
             logger.error(f"❌ {e}")
             return None
     
-    async def fetch(self) -> Optional[Dict]:
+    async def _fetch_api_bounded(self, url: str) -> Optional[Dict]:
+        """_fetch_api with an overall deadline - a hang is treated as a broken session"""
+        try:
+            async with asyncio.timeout(BROWSER_FETCH_TIMEOUT):
+                return await self._fetch_api(url)
+        except TimeoutError:
+            logger.error(f"❌ Browser fetch timed out after {BROWSER_FETCH_TIMEOUT}s")
+            self._page_ready = False
+            return {'error': 'no_token'}
+    
+    async def fetch(self, url: str = API_FULL_URL) -> Optional[Dict]:
         """Fetch tickets with automatic token refresh on failure"""
-        result = await self._fetch_api()
+        # ⚡ Fast path: cached token + direct HTTP, no Chromium at all
+        result = await self._fetch_api_http(url)
+        if 'error' not in result:
+            return result
+        
+        # Slow path: the browser is only started when the direct call fails
+        if not self.page and not await self.setup():
+            return None
+        result = await self._fetch_api_bounded(url)
         
         # If token error, try refresh and retry once
         if result and 'error' in result and result['error'] in ['no_token', 401]:
@@ -919,13 +1511,13 @@ class Monitor:
             if await browser_refresh_token(self.page, self.log_report):
                 # Save the refreshed state
                 try:
-                    await self.ctx.storage_state(path=str(SESSION_FILE))
+                    await save_storage_state(self.ctx)
                     logger.info("💾 Saved refreshed session")
                 except:
                     pass
                 
                 # Retry API call with fresh token
-                result = await self._fetch_api()
+                result = await self._fetch_api_bounded(url)
                 if result and 'error' not in result:
                     logger.info("✅ Retry successful after token refresh!")
                     return result
@@ -944,68 +1536,75 @@ class Monitor:
         
         return result
     
-    async def _fetch_subscriptions_api(self) -> Optional[Dict]:
-        """Fetch ALL subscriptions from API (Pagination Support)"""
-        all_items = []
-        page = 1
+    async def _iter_subscriptions(self):
+        """
+        Yield ALL subscriptions as their pages arrive - page 1 gives totalCount, the rest are fetched concurrently.
+        Raises RuntimeError if any page fails (the caller must drop the partial diff)
+        """
         page_size = 100
-        total_count = 0
+        refresh_lock = asyncio.Lock()
+        refreshed = False
         
         logger.info("📦 Fetching subscription list...")
         
-        while True:
-            try:
-                # Add random small delay between pages
-                if page > 1: await asyncio.sleep(random.uniform(0.5, 1.5))
-                
-                result = await self.page.evaluate(f"""
-                    (async()=>{{
-                        try{{
-                            let token = localStorage.getItem('access_token');
-                            if (!token) return {{error:'no_token'}};
-                            
-                            let r = await fetch('{SUBSCRIPTIONS_API_URL}?pageSize={page_size}&pageNumber={page}',{{
-                                headers:{{'Authorization':'Bearer '+token,'Accept':'application/json'}}
-                            }});
-                            
-                            if (r.status === 401) {{
-                                await new Promise(x=>setTimeout(x,2000));
-                                token = localStorage.getItem('access_token');
-                                r = await fetch('{SUBSCRIPTIONS_API_URL}?pageSize={page_size}&pageNumber={page}',{{
-                                    headers:{{'Authorization':'Bearer '+token,'Accept':'application/json'}}
-                                }});
-                            }}
-                            
-                            return r.ok ? await r.json() : {{error:r.status}};
-                        }}catch(e){{return {{error:e.message}};}}
-                    }})()
-                """)
-                
+        async def _fetch_page(n: int) -> Dict:
+            nonlocal refreshed
+            url = f'{SUBSCRIPTIONS_API_URL}?pageSize={page_size}&pageNumber={n}'
+            result = await self._api_get(url)
+            # Token expired mid-run → refresh once via the browser (shared by all pages) and retry
+            if result.get('error') in ('no_token', 401):
+                async with refresh_lock:
+                    if not refreshed:
+                        refreshed = True
+                        await self._refresh_session()
+                result = await self._api_get(url)
+            if 'error' in result:
+                logger.error(f"❌ Subscriptions Page {n}: {result['error']}")
+            return result
+        
+        sem = asyncio.Semaphore(4)
+        
+        async def _sem_fetch(n: int) -> Dict:
+            async with sem:
+                return await _fetch_page(n)
+        
+        first = await _fetch_page(1)
+        if 'error' in first:
+            raise RuntimeError(f"subscriptions page 1: {first['error']}")
+        total_count = first.get('totalCount', 0)
+        fetched = 0
+        for sub in first.get('items', []):
+            fetched += 1
+            yield sub
+        
+        # The diff runs on each page while the others are still in flight
+        tasks = [asyncio.ensure_future(_sem_fetch(n)) for n in range(2, -(-total_count // page_size) + 1)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                result = await fut
                 if 'error' in result:
-                    logger.error(f"❌ Subscriptions Page {page}: {result['error']}")
-                    # If first page fails, abort. If subsequent, return what we have? 
-                    # Better to return None to trigger retry or avoid partial data.
-                    return None
-                
-                items = result.get('items', [])
-                count = len(items)
-                total_count = result.get('totalCount', 0)
-                
-                all_items.extend(items)
-                logger.debug(f"📄 Page {page}: Got {count} items (Total so far: {len(all_items)})")
-                
-                # Check termination
-                if count < page_size or len(all_items) >= total_count:
-                    break
-                    
-                page += 1
-                
-            except Exception as e:
-                logger.error(f"❌ Subscriptions fetch error on page {page}: {e}")
-                return None
+                    raise RuntimeError(f"subscriptions page: {result['error']}")
+                for sub in result.get('items', []):
+                    fetched += 1
+                    yield sub
+        finally:
+            for t in tasks:
+                t.cancel()
         
-        logger.info(f"✅ Fetched ALL subscriptions: {len(all_items)}/{total_count}")
-        return {'items': all_items, 'totalCount': total_count}
+        logger.info(f"✅ Fetched ALL subscriptions: {fetched}/{total_count}")
+    
+    async def _diff_subscriptions(self, record: bool) -> Optional[int]:
+        """Diff each subscription as its page arrives - returns the count, or None if a page failed (nothing staged is applied)"""
+        self.subscription_state.begin(record=record)
+        fetched = 0
+        try:
+            async for sub in self._iter_subscriptions():
+                self.subscription_state.update_one(sub)
+                fetched += 1
+        except Exception as e:
+            logger.error(f"❌ Subscriptions fetch error: {e}")
+            return None
+        return fetched
     
     async def run(self):
         self.report_buffer = []
@@ -1017,7 +1616,11 @@ class Monitor:
         # 🔘 Process any pending button clicks FIRST
         await process_pending_button_clicks()
         
-        startup_delay()
+        if self._token or self.page:
+            await startup_delay()
+        else:
+            # No cached token → the browser is needed anyway: launch it during the jitter
+            await asyncio.gather(startup_delay(), self.setup())
         
         # 🛡️ Safety: Prevent frequent runs (Dual Scheduler Protection)
         last_run = self.state.get_last_run()
@@ -1028,14 +1631,21 @@ class Monitor:
                 self.log_report("🛑 Skipped: Too frequent (Rate Limit)")
                 # Send brief report to dev so they know it worked but skipped
                 # await self.telegram.send_to_dev(f"⚠️ <b>Skipped Run</b>\nReason: Recently ran ({elapsed:.0f}s ago)")
+                if not self.keep_alive:
+                    await self.close()
                 return True
         
-        if not await self.setup():
-            return False
-        
+        self._saver_task = asyncio.create_task(self._saver_loop())
+        sub_task = None
         try:
-            result = await self.fetch()
-            if not result:
+            # First run only needs IDs to seed the state - ask for a bigger, sparse page
+            first_run = len(self.state.known) == 0
+            result = await self.fetch(SEED_IDS_URL if first_run else API_FULL_URL)
+            # None = refresh/login already failed (and alerted) - only a plain API error (e.g. 400 on the
+            # sparse query) is worth one retry with the full page
+            if first_run and result is not None and 'error' in result:
+                result = await self.fetch()
+            if not result or 'error' in result:
                 self.log_report("❌ Fetch Failed")
                 return False
             
@@ -1043,12 +1653,9 @@ class Monitor:
             self.log_report(f"📊 Tickets: {len(items)} fetched")
             
             # First run: mark all as known
-            if len(self.state.known) == 0:
+            if first_run:
                 logger.info("🎯 First run - saving existing tickets")
-                for t in items:
-                    if t.get('displayId'):
-                        self.state.add(t['displayId'])
-                self.state.save()
+                self.state.seed(t['displayId'] for t in items if t.get('displayId'))
                 await self.telegram.send_to_dev(f"""🚀 <b>FTTH Monitor Started</b>
 ━━━━━━━━━━━━━━━━━
 
@@ -1058,16 +1665,37 @@ class Monitor:
 ━━━━━━━━━━━━━━━━━""")
                 return True
             
-            # Find new tickets
-            new = [t for t in items if t.get('displayId') and self.state.is_new(t['displayId'])]
+            # The token is known-good now: page through subscriptions while tickets are processed
+            first_sub_run = not self.subscription_state.subscriptions
+            sub_task = asyncio.create_task(self._diff_subscriptions(record=not first_sub_run))
+            
+            # Find new tickets - one C-level set difference, API order kept
+            id_to_t = {t['displayId']: t for t in items if t.get('displayId')}
+            new_ids = self.state.new_ids(id_to_t)
+            new = [t for tid, t in id_to_t.items() if tid in new_ids]
             
             if new:
                 logger.info(f"🆕 {len(new)} NEW tickets found")
                 self.log_report(f"🆕 Found {len(new)} NEW tickets")
-                sent_count = 0
+                self.state.add_many(t['displayId'] for t in new)
+                # Time filter first: only recent tickets get a phone lookup + notification
+                now = datetime.now(timezone.utc)
+                cutoff = now - timedelta(hours=MAX_TICKET_AGE_HOURS)
+                recent = []
                 for t in new:
-                    self.state.add(t['displayId'])
-                    
+                    created_at = t.get('createdAt', '')
+                    try:
+                        if created_at:
+                            ticket_time = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+                            if ticket_time < cutoff:
+                                age_hours = (now - ticket_time).total_seconds() / 3600
+                                logger.info(f"⏭️ Skipping old ticket {t['displayId']} (age: {age_hours:.1f}h)")
+                                continue
+                    except Exception as e:
+                        logger.warning(f"⚠️ Could not parse ticket date: {e}")
+                    recent.append(t)
+                
+                for t in recent:
                     # 📞 Inject Phone Number
                     try:
                         customer_id = t.get('customer', {}).get('id')
@@ -1078,36 +1706,19 @@ class Monitor:
                                 logger.info(f"📱 Found phone for ticket {t['displayId']}: {phone}")
                     except Exception as e:
                         logger.error(f"❌ Phone injection error: {e}")
-                    
-                    # Time filter: only send notification for recent tickets
-                    try:
-                        created_at = t.get('createdAt', '')
-                        if created_at:
-                            ticket_time = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                            now = datetime.now(timezone.utc)
-                            age_hours = (now - ticket_time).total_seconds() / 3600
-                            
-                            if age_hours > MAX_TICKET_AGE_HOURS:
-                                logger.info(f"⏭️ Skipping old ticket {t['displayId']} (age: {age_hours:.1f}h)")
-                                continue
-                    except Exception as e:
-                        logger.warning(f"⚠️ Could not parse ticket date: {e}")
-                    
-                    # 1. Telegram: Instant Notification (UNTOUCHED)
-                    await self.telegram.send_to_all(self.telegram.format(t))
-                    
-                    # 2. WhatsApp: Buffer for batch sending
-                    wa_msg = self.whatsapp.format(t)
-                    self.whatsapp_buffer.append(wa_msg)
-                    
-                    sent_count += 1
-                    await asyncio.sleep(random.uniform(1, 3))
+                
+                # 1. Telegram: concurrent sends, paced by the Telegram rate limiter
+                await self._send_all((self.telegram.format(t), 'notify_tickets') for t in recent)
+                
+                # 2. WhatsApp: Buffer for batch sending
+                self.whatsapp_buffer.extend(self.whatsapp.format(t) for t in recent)
+                sent_count = len(recent)
                 
                 logger.info(f"📤 Processed {sent_count}/{len(new)} tickets")
             else:
                 logger.info("✅ No new tickets")
             
-            self.state.save()
+            self._mark_dirty(self.state)
             
             # ═══════════════════════════════════════════════════
             # 📦 SUBSCRIPTION MONITORING
@@ -1115,28 +1726,19 @@ class Monitor:
             logger.info("=" * 50)
             logger.info("📦 Checking Subscriptions...")
             
-            sub_result = await self._fetch_subscriptions_api()
-            if sub_result:
-                subscriptions = sub_result.get('items', [])
-                self.log_report(f"📦 Subscriptions: {len(subscriptions)} fetched")
+            fetched = await sub_task
+            if fetched is not None:
+                changes = self.subscription_state.commit()
+                self.log_report(f"📦 Subscriptions: {fetched} fetched")
                 
                 # First run: save all subscription statuses
-                if len(self.subscription_state.subscriptions) == 0:
+                if first_sub_run:
                     logger.info("🎯 First run - saving subscription states")
-                    for sub in subscriptions:
-                        sub_id = sub.get('self', {}).get('id') or sub.get('id')
-                        status = sub.get('status', '').lower()
-                        if status in ['active', 'نشط', 'جاري']:
-                            status = 'active'
-                        elif status in ['expired', 'منتهي', 'منتهية']:
-                            status = 'expired'
-                        if sub_id:
-                            self.subscription_state.subscriptions[sub_id] = status
-                    self.subscription_state.save()
+                    self._mark_dirty(self.subscription_state)
                     logger.info(f"📋 Saved {len(self.subscription_state.subscriptions)} subscriptions")
                 else:
                     # Check for changes
-                    expired, renewed, new_subs = self.subscription_state.get_changes(subscriptions)
+                    expired, renewed, new_subs = changes
                     
                     # 🔍 DEBUG: Log data structure if we have N/A fields
                     if expired or renewed or new_subs:
@@ -1159,39 +1761,27 @@ class Monitor:
 
                         changes = expired + renewed + new_subs
                         if changes:
-                            logger.info(f"🔍 DEBUG DATA FOR FIRST CHANGE: {json.dumps(changes[0], ensure_ascii=False)}")
-
-                    # Send notifications for expired subscriptions
-                    for sub in expired:
-                        logger.info(f"🔴 Expired: {sub.get('id', 'N/A')}")
-                        msg = self.telegram.format_expired(sub)
-                        await self.telegram.send_to_all(msg)
-                        
-                        # Buffer for WhatsApp
-                        self.whatsapp_buffer.append(f"🔴 *اشتراك منتهي*\n{self.whatsapp.format_simple(sub)}")
-                        await asyncio.sleep(random.uniform(0.5, 1.5))
-                    
-                    # Send notifications for renewed subscriptions
-                    for sub in renewed:
-                        logger.info(f"🟢 Renewed: {sub.get('id', 'N/A')}")
-                        msg = self.telegram.format_renewed(sub)
-                        await self.telegram.send_to_all(msg)
-                        
-                        # Buffer for WhatsApp
-                        self.whatsapp_buffer.append(f"🟢 *تم التجديد*\n{self.whatsapp.format_simple(sub)}")
-                        await asyncio.sleep(random.uniform(0.5, 1.5))
+                            logger.info(f"🔍 DEBUG DATA FOR FIRST CHANGE: {orjson.dumps(changes[0]).decode()}")
+
+                    # Queue the change notifications (bursts of one kind go out as list messages);
+                    # each subscription is parsed once and rendered for both Telegram and WhatsApp
+                    outbox = []
+                    for kind, subs, fmt, icon, title, setting in (
+                        ('expired', expired, self.telegram.format_expired, '🔴', 'اشتراك منتهي', 'notify_expired'),
+                        ('renewed', renewed, self.telegram.format_renewed, '🟢', 'تم التجديد', 'notify_renewed'),
+                        ('new', new_subs, self.telegram.format_new_subscriber, '🆕', 'مشترك جديد', 'notify_new_sub'),
+                    ):
+                        views = [Subscription.from_api(sub) for sub in subs]
+                        for d in views:
+                            logger.info(f"{icon} {kind}: {d.sub_id}")
+                            self.whatsapp_buffer.append(f"{icon} *{title}*\n{self.whatsapp.format_simple(d)}")
+                        # Batch titles don't carry the single-message markers - tag the toggle explicitly
+                        if len(views) > 1:
+                            outbox.extend((msg, setting) for msg in self.telegram.format_batch(kind, views))
+                        else:
+                            outbox.extend((fmt(d), setting) for d in views)
                     
-                    # Send notifications for new subscribers
-                    for sub in new_subs:
-                        logger.info(f"🆕 New subscriber: {sub.get('id', 'N/A')}")
-                        msg = self.telegram.format_new_subscriber(sub)
-                        await self.telegram.send_to_all(msg)
-                        
-                        # Buffer for WhatsApp
-                        self.whatsapp_buffer.append(f"🆕 *مشترك جديد*\n{self.whatsapp.format_simple(sub)}")
-                        await asyncio.sleep(random.uniform(0.5, 1.5))
-
-
+                    await self._send_all(outbox)
                     
                     # Log summary
                     if expired or renewed or new_subs:
@@ -1199,7 +1789,12 @@ class Monitor:
                     else:
                         logger.info("✅ No subscription changes")
                     
-                    self.subscription_state.save()
+                    self._mark_dirty(self.subscription_state)
+
+            # 📱 WhatsApp: one digest per poll instead of one POST per item
+            if self.whatsapp_buffer:
+                await self.whatsapp.flush(self.whatsapp_buffer)
+                self.whatsapp_buffer.clear()
 
             # Define variables for report safely
             sub_count = len(self.subscription_state.subscriptions)
@@ -1208,12 +1803,7 @@ class Monitor:
             renewed_count = len(renewed) if 'renewed' in locals() else 0
             new_subs_count = len(new_subs) if 'new_subs' in locals() else 0
 
-            # 📊 Detailed Run Log (For Developer ONLY)
-            if self.report_buffer:
-                log_text = "📊 <b>تقرير التشغيل (Run Log)</b>\n━━━━━━━━━━━━━━━━━\n" + "\n".join(self.report_buffer)
-                await self.telegram.send_to_dev(log_text)
-
-            await self.telegram.send_to_dev(f"""📊 <b>FTTH Monitor Run Summary</b>
+            summary_text = f"""📊 <b>FTTH Monitor Run Summary</b>
 ━━━━━━━━━━━━━━━━━
 
 🎫 <b>التذاكر:</b> {len(self.state.known)} معروفة
@@ -1225,17 +1815,84 @@ class Monitor:
 🆕 <b>جدد:</b> {new_subs_count}
 
 ✅ <b>الحالة:</b> Run completed successfully
-━━━━━━━━━━━━━━━━━""")
+━━━━━━━━━━━━━━━━━"""
+
+            # 📊 Detailed Run Log + summary (For Developer ONLY) - one message when it fits
+            if self.report_buffer:
+                log_text = "📊 <b>تقرير التشغيل (Run Log)</b>\n━━━━━━━━━━━━━━━━━\n" + "\n".join(self.report_buffer)
+                combined = f"{log_text}\n\n{summary_text}"
+                if len(combined) <= TELEGRAM_MAX_CHARS:
+                    await self.telegram.send_to_dev(combined)
+                else:
+                    await self.telegram.send_to_dev(log_text)
+                    await self.telegram.send_to_dev(summary_text)
+            else:
+                await self.telegram.send_to_dev(summary_text)
             
             return True
             
         finally:
-            if self.browser:
-                await self.browser.close()
-            if hasattr(self, 'pw'):
-                await self.pw.stop()
+            if sub_task and not sub_task.done():
+                sub_task.cancel()
+            await self._stop_saver()
+            await self.telegram.close()
+            await self.whatsapp.close()
+            if self._http:
+                await self._http.close()
+            if not self.keep_alive:
+                await self.close()
+    
+    async def close(self):
+        """Shut down Playwright (browser + driver)"""
+        if self.ctx and not CDP_URL:
+            await self.ctx.close()
+        if self.browser:
+            # Over CDP this only disconnects - the remote browser and its context stay up
+            await self.browser.close()
+        if hasattr(self, 'pw'):
+            await self.pw.stop()
+            del self.pw
+        self.browser = self.ctx = self.page = None
+        self._page_ready = False
+    
+    async def _recycle_page(self):
+        """Drop the long-lived page and Chromium's HTTP cache so a looping monitor's RSS stays flat"""
+        if not self.ctx or not self.page:
+            return
+        try:
+            cdp = await self.ctx.new_cdp_session(self.page)
+            await cdp.send('Network.clearBrowserCache')
+            await cdp.detach()
+            await self.page.close()
+            # Route blocker + init script live on the context, so the new page inherits them
+            self.page = await self.ctx.new_page()
+            self._page_ready = False
+            logger.info("♻️ Browser page recycled")
+        except Exception as e:
+            logger.warning(f"⚠️ Page recycle failed: {e}")
+    
+    async def run_forever(self, interval: float):
+        """
+        وضع التشغيل المستمر (--loop)
+        Poll forever, reusing the same browser page between polls
+        """
+        self.keep_alive = True
+        polls = 0
+        try:
+            while True:
+                await self.run()
+                polls += 1
+                if polls % PAGE_RECYCLE_POLLS == 0:
+                    await self._recycle_page()
+                logger.info(f"💤 Next poll in {interval:.0f}s")
+                await asyncio.sleep(interval)
+        finally:
+            await self.close()
 
 
 if __name__ == '__main__':
+    if '--loop' in sys.argv:
+        asyncio.run(Monitor().run_forever(float(os.getenv('POLL_INTERVAL_SECONDS', '300'))))
+        sys.exit(0)
     success = asyncio.run(Monitor().run())
     sys.exit(0 if success else 1)
@@ -1,14 +1,37 @@
 #!/usr/bin/env python3
 import os
-import json
+import functools
+import base64
+import time
 import logging
+import tempfile
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, CallbackQueryHandler
-import subprocess
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 import asyncio
+import aiohttp
+
+try:
+    import orjson
+    _loads = orjson.loads
+    def _dumps(obj) -> bytes:
+        """Indented JSON bytes (settings.json stays diff-friendly in the repo)"""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    def _json_str(obj) -> str:
+        """Compact serializer for aiohttp's json= payloads"""
+        return orjson.dumps(obj).decode()
+except ImportError:  # the bot host may run without the monitor's requirements
+    import json
+    _loads = json.loads
+    def _dumps(obj) -> bytes:
+        """Indented JSON bytes (settings.json stays diff-friendly in the repo)"""
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode()
+    _json_str = json.dumps
 
 # Configure Logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -20,6 +43,9 @@ TOKEN = os.getenv('TELEGRAM_TOKEN')
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 GITHUB_REPO = 'Kilua-Zoldyck/awefae-fascoasdma-emkfa-zdadjkmslfcmzmds'
 SETTINGS_FILE = Path('settings.json')
+# Privileged users (Owner & Dev) - normalized once, not per click
+_ALLOW_LIST = frozenset(str(x).strip() for x in (os.getenv('ADMIN_CHAT_ID'), os.getenv('DEV_CHAT_ID')) if x)
+CONTENTS_URL = f"https://api.github.com/repos/{GITHUB_REPO}/contents/settings.json"
 
 # Valid Keys mapping to readable labels
 SETTINGS_MAP = {
@@ -32,30 +58,66 @@ SETTINGS_MAP = {
 # -----------------------------------------------------------------------------
 # GitHub Integration - ALWAYS FETCH FROM CLOUD FIRST
 # -----------------------------------------------------------------------------
+_session = None  # one keep-alive session to api.github.com for the bot's lifetime
+_gh_cache = {"etag": None, "body": None, "ts": 0.0}  # last settings.json seen on GitHub
+_GH_CACHE_TTL = 5.0  # a click's before/after loads share one fetch
+_gh_sha = None  # blob sha of our last PUT - lets the next push skip the GET
+SYNC_DEBOUNCE = 5.0  # quiet period before toggles are pushed - rapid clicks become one commit
+SYNC_RETRY_DELAYS = (15.0, 60.0, 300.0)  # backoff for a failed push before the toggles are given up
+_pending_settings = None  # toggled locally, not pushed yet
+_sync_task = None
+
+async def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=16, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=10),
+            json_serialize=_json_str
+        )
+    return _session
+
+async def _on_shutdown(application):
+    """post_shutdown hook - push any debounced toggles, then release the GitHub keep-alive connections"""
+    global _session
+    if _sync_task and not _sync_task.done():
+        _sync_task.cancel()
+    await _flush_sync()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
 async def fetch_from_github():
     """Fetch settings.json from GitHub (REAL-TIME SOURCE OF TRUTH)"""
     try:
-        import aiohttp
         if not GITHUB_TOKEN:
             logger.warning("⚠️ GITHUB_TOKEN not set - using local file")
             return None
         
-        url = f"https://api.github.com/repos/{GITHUB_REPO}/contents/settings.json"
+        if _gh_cache["body"] is not None and time.monotonic() - _gh_cache["ts"] < _GH_CACHE_TTL:
+            return dict(_gh_cache["body"])
+        
         headers = {
             "Authorization": f"token {GITHUB_TOKEN}",
             "Accept": "application/vnd.github.v3.raw"
         }
+        if _gh_cache["etag"]:
+            headers["If-None-Match"] = _gh_cache["etag"]
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=10) as resp:
-                if resp.status == 200:
-                    content = await resp.text()
-                    settings = json.loads(content)
-                    logger.info("☁️ Settings loaded from GitHub")
-                    return settings
-                else:
-                    logger.error(f"❌ GitHub fetch failed: {resp.status}")
-                    return None
+        session = await _get_session()
+        async with session.get(CONTENTS_URL, headers=headers) as resp:
+            if resp.status == 304:
+                # Unchanged - free for the rate limit
+                _gh_cache["ts"] = time.monotonic()
+                return dict(_gh_cache["body"])
+            if resp.status == 200:
+                settings = _loads(await resp.read())
+                _gh_cache.update(etag=resp.headers.get("ETag"), body=settings, ts=time.monotonic())
+                logger.info("☁️ Settings loaded from GitHub")
+                return dict(settings)
+            else:
+                logger.error(f"❌ GitHub fetch failed: {resp.status}")
+                return None
     except Exception as e:
         logger.error(f"❌ GitHub fetch error: {e}")
         return None
@@ -67,43 +129,167 @@ def load_settings_local():
     """Fallback: Load from local file"""
     if SETTINGS_FILE.exists():
         try:
-            return json.loads(SETTINGS_FILE.read_text())
-        except:
+            return _loads(SETTINGS_FILE.read_bytes())
+        except (OSError, ValueError):  # unreadable / corrupt file → defaults
             pass
     return {k: True for k in SETTINGS_MAP.keys()}
 
+# In-memory copy of the last known settings - the fallback never has to touch the disk
+_SETTINGS = load_settings_local()
+_settings_lock = asyncio.Lock()  # toggles are read-modify-write
+_push_lock = asyncio.Lock()  # one Contents API commit at a time (sha → PUT)
+
+def _persist(settings):
+    """
+    The one place settings.json is written - one unbuffered write to a temp file, then os.replace,
+    so a crash mid-write can never leave a truncated file (which would load as all-defaults)
+    """
+    data = _dumps(settings)
+    # Unique temp name per writer - concurrent handlers persist from different worker threads
+    fd, tmp = tempfile.mkstemp(dir=SETTINGS_FILE.parent, prefix=SETTINGS_FILE.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb', buffering=0) as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600 - keep settings.json as readable as before
+        os.replace(tmp, SETTINGS_FILE)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+async def save_settings_local(settings):
+    """Update the in-memory copy and persist in a worker thread - a slow disk must not stall other clicks"""
+    _SETTINGS.clear()
+    _SETTINGS.update(settings)
+    await asyncio.to_thread(_persist, settings)
+
 async def load_settings():
-    """Load settings: GitHub FIRST, then local fallback"""
+    """Load settings: unpushed toggles, then GitHub, then local fallback"""
+    # 0. A debounced push is pending - GitHub doesn't have these yet
+    if _pending_settings is not None:
+        return dict(_pending_settings)
+    
     # 1. Try GitHub (Real-time)
     settings = await fetch_from_github()
     if settings:
+        _SETTINGS.clear()
+        _SETTINGS.update(settings)
         return settings
     
-    # 2. Fallback to local
+    # 2. Fallback to the in-memory copy
     logger.warning("⚠️ Using local settings (GitHub unavailable)")
-    return load_settings_local()
+    return dict(_SETTINGS)
 
-def sync_to_github():
-    """Pushes the updated settings.json to GitHub so Actions can see it"""
+async def push_to_github(settings):
+    """Commits settings.json through the GitHub Contents API so Actions can see it (no local git)"""
+    global _gh_sha
+    if not GITHUB_TOKEN:
+        logger.warning("⚠️ GITHUB_TOKEN not set - settings kept locally")
+        return False
+    headers = {
+        "Authorization": f"token {GITHUB_TOKEN}",
+        "Accept": "application/vnd.github.v3+json"
+    }
     try:
-        # 1. Config User (if not set)
-        subprocess.run(["git", "config", "user.name", "Settings Bot"], check=False)
-        subprocess.run(["git", "config", "user.email", "bot@wakeel.local"], check=False)
-        
-        # 2. Add, Commit, Push
-        subprocess.run(["git", "add", "settings.json"], check=True)
-        subprocess.run(["git", "commit", "settings.json", "-m", "config: update notification settings via bot"], check=False)
-        
-        # Pull changes to avoid conflict (Rebase strategy)
-        subprocess.run(["git", "pull", "--rebase"], check=True)
-        
-        subprocess.run(["git", "push"], check=True)
+        session = await _get_session()
+        body = {
+            "message": "config: update notification settings via bot",
+            "content": base64.b64encode(_dumps(settings)).decode(),
+            "committer": {"name": "Settings Bot", "email": "bot@wakeel.local"},
+        }
+        # Push-first: PUT with the cached sha and only look it up when GitHub rejects it
+        for attempt in range(2):
+            sha = _gh_sha
+            if not sha:
+                # Current blob sha (required to update an existing file)
+                async with session.get(CONTENTS_URL, headers=headers) as resp:
+                    sha = _loads(await resp.read()).get('sha') if resp.status == 200 else None
+            if sha:
+                body["sha"] = sha
+            else:
+                body.pop("sha", None)
+            
+            # One PUT = one commit
+            async with session.put(CONTENTS_URL, headers=headers, json=body) as resp:
+                if resp.status in (200, 201):
+                    _gh_sha = (_loads(await resp.read()).get('content') or {}).get('sha')
+                    break
+                # 409/422: the file moved on since our sha (e.g. edited from Actions)
+                _gh_sha = None
+                if resp.status in (409, 422) and attempt == 0 and sha:
+                    continue
+                logger.error(f"❌ Failed to sync to GitHub: {resp.status}")
+                return False
+        # Our own commit just changed the file - next load must see it
+        _gh_cache.update(etag=None, body=None, ts=0.0)
         logger.info("✅ Settings synced to GitHub successfully")
         return True
     except Exception as e:
         logger.error(f"❌ Failed to sync to GitHub: {e}")
         return False
 
+def schedule_push(settings, notify=None):
+    """
+    Debounce: (re)start the SYNC_DEBOUNCE timer - only the last state of a burst is pushed.
+    `notify(ok)` is awaited once that push finishes (the UI doesn't wait for GitHub)
+    """
+    global _pending_settings, _sync_task
+    _pending_settings = dict(settings)
+    if _sync_task and not _sync_task.done():
+        _sync_task.cancel()
+    _sync_task = asyncio.create_task(_debounced_push(notify))
+
+async def _debounced_push(notify):
+    # Detached task - anything escaping here would be lost as "Task exception was never retrieved"
+    global _pending_settings
+    ok = False
+    for attempt, delay in enumerate((SYNC_DEBOUNCE, *SYNC_RETRY_DELAYS)):
+        if attempt:
+            logger.warning(f"⚠️ GitHub push failed - retrying in {delay:.0f}s")
+        try:
+            ok = await _flush_sync(delay)
+        except Exception as e:
+            logger.error(f"❌ Background push error: {e}")
+            ok = False
+        if ok or not GITHUB_TOKEN:
+            break
+    if not ok:
+        # Give up: stop shadowing GitHub with toggles the monitor will never see
+        logger.error("❌ Giving up on pushing settings - GitHub copy unchanged")
+        _pending_settings = None
+    if notify:
+        try:
+            await notify(ok)
+        except Exception as e:
+            logger.warning(f"UI sync status update warning: {e}")
+
+async def _flush_sync(delay=0.0):
+    """Push the pending settings (after `delay`) - returns True when nothing is left unpushed"""
+    global _pending_settings
+    if delay:
+        await asyncio.sleep(delay)
+    async with _push_lock:
+        settings = _pending_settings
+        if settings is None:
+            return True
+        ok = await push_to_github(settings)
+        if ok and _pending_settings is settings:
+            _pending_settings = None
+        return ok
+
+_ADMIN_TTL = 60.0
+_admin_cache = {}  # (chat_id, user_id) -> (member status, expires_at)
+
+async def get_member_status(bot, chat_id, user_id):
+    """get_chat_member with a short TTL - repeat clicks by the same user skip the Bot API round-trip"""
+    key = (chat_id, user_id)
+    entry = _admin_cache.get(key)
+    now = time.monotonic()
+    if entry and entry[1] > now:
+        return entry[0]
+    member = await bot.get_chat_member(chat_id, user_id)
+    _admin_cache[key] = (member.status, now + _ADMIN_TTL)
+    return member.status
+
 def get_iraq_time():
     """Get current time in Iraq (UTC+3) with date"""
     iraq_time = datetime.utcnow() + timedelta(hours=3)
@@ -125,33 +311,46 @@ def get_iraq_time():
     
     return f"{date_str} | {time_str}"
 
+# Header Button (Info only) - buttons are immutable, so one instance serves every keyboard
+_HEADER_ROW = [InlineKeyboardButton("⚙️ لوحة التحكم", callback_data="ignore")]
+
+# Every toggle button in each of its three states, built once at import
+_BTN_ON = {k: InlineKeyboardButton(f"✅ {v}", callback_data=f"toggle:{k}") for k, v in SETTINGS_MAP.items()}
+_BTN_OFF = {k: InlineKeyboardButton(f"⛔ {v}", callback_data=f"toggle:{k}") for k, v in SETTINGS_MAP.items()}
+_BTN_LOADING = {k: InlineKeyboardButton(f"⏳ {v}...", callback_data=f"toggle:{k}") for k, v in SETTINGS_MAP.items()}
+
 def build_keyboard(settings, loading_key=None):
-    keyboard = []
-    
-    # Header Button (Info only)
-    keyboard.append([InlineKeyboardButton("⚙️ لوحة التحكم", callback_data="ignore")])
-    
-    for key, label in SETTINGS_MAP.items():
-        if key == loading_key:
-            # Loading State
-            text = f"⏳ {label}..."
-        else:
-            # Normal State
-            is_on = settings.get(key, True)
-            status_icon = "✅" if is_on else "⛔"
-            text = f"{status_icon} {label}"
-        
-        btn = InlineKeyboardButton(text, callback_data=f"toggle:{key}")
-        keyboard.append([btn])
-        
+    # Only 4 booleans + loading_key vary, so every keyboard is built once and reused
+    return _kb(tuple(bool(settings.get(key, True)) for key in SETTINGS_MAP), loading_key)
+
+@functools.lru_cache(maxsize=256)
+def _kb(state, loading_key):
     # Sync Actions
     refresh_text = "⏳ جاري التحديث..." if loading_key == "refresh" else "🔄 تحديث الواجهة"
-    keyboard.append([InlineKeyboardButton(refresh_text, callback_data="refresh")])
-    
     sync_text = "⏳ جاري المزامنة..." if loading_key == "forced_sync" else "♻️ مزامنة شاملة"
-    keyboard.append([InlineKeyboardButton(sync_text, callback_data="forced_sync")])
     
-    return InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup([
+        _HEADER_ROW,
+        *([_BTN_LOADING[key] if key == loading_key else _BTN_ON[key] if is_on else _BTN_OFF[key]]
+          for key, is_on in zip(SETTINGS_MAP, state)),
+        [InlineKeyboardButton(refresh_text, callback_data="refresh")],
+        [InlineKeyboardButton(sync_text, callback_data="forced_sync")],
+    ])
+
+_LAST_SENT_MAX = 256  # dashboards remembered for edit dedupe - older ones just get a real edit
+_last_sent = OrderedDict()  # (chat_id, message_id) -> hash of the text + keyboard it currently shows
+
+async def edit_if_changed(query, text, markup):
+    """edit_message_text, skipped when the message already shows exactly this (no API call, no 'not modified' error)"""
+    key = (query.message.chat.id, query.message.message_id)
+    h = hash((text, repr(markup.to_dict())))
+    if _last_sent.get(key) == h:
+        return
+    await query.edit_message_text(text=text, reply_markup=markup, parse_mode='Markdown')
+    _last_sent[key] = h
+    _last_sent.move_to_end(key)
+    if len(_last_sent) > _LAST_SENT_MAX:
+        _last_sent.popitem(last=False)
 
 # -----------------------------------------------------------------------------
 # Handlers
@@ -176,37 +375,50 @@ async def start_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
             chat_id=update.effective_chat.id,
             message_id=message.message_id
         )
-    except:
-        pass
+    except TelegramError as e:  # e.g. no pin rights in this chat
+        logger.info(f"Pin skipped: {e}")
+
+def _dashboard_text(status_msg):
+    return (
+        "👋 **لوحة التحكم**\n"
+        f"📅 الوقت: {get_iraq_time()}\n"
+        f"📊 الحالة: {status_msg}\n\n"
+        "إليك الإعدادات الحالية:"
+    )
+
+async def _show_sync_result(query, ok):
+    """Second edit after a background push - the click itself was answered with the local state"""
+    status_msg = "✅ **تم الحفظ والمزامنة**" if ok else "❌ **فشلت المزامنة** (لم يتم تطبيق التغيير)"
+    await edit_if_changed(query, _dashboard_text(status_msg), build_keyboard(_SETTINGS))
 
 async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles button clicks"""
     query = update.callback_query
+    data = query.data
+    
+    # The header button changes nothing - answer it before any permission lookup
+    if data == "ignore":
+        await query.answer("هذا مجرد عنوان 🏷️")
+        return
     
     # --- SECURITY CHECK ---
+    # (No await before the answer on the privileged path; a callback query can only be answered once,
+    #  so denials must come before the ACK)
     user = query.from_user
     chat = query.message.chat
     
-    # 0. Privileged Users (Owner & Dev)
-    admin_id = os.getenv('ADMIN_CHAT_ID')
-    dev_id = os.getenv('DEV_CHAT_ID')
-    
-    # Normalize IDs
-    u_id = str(user.id).strip()
-    allow_list = [str(x).strip() for x in [admin_id, dev_id] if x]
-    
-    # 1. Pass if User is Privileged
-    if u_id in allow_list:
+    # 1. Pass if User is Privileged (Owner & Dev)
+    if str(user.id) in _ALLOW_LIST:
         pass
     
     # 2. If Group/Supergroup, allow Admin
     elif chat.type in ['group', 'supergroup']:
         try:
-            member = await context.bot.get_chat_member(chat.id, user.id)
-            if member.status not in ['creator', 'administrator']:
+            status = await get_member_status(context.bot, chat.id, user.id)
+            if status not in ['creator', 'administrator']:
                 await query.answer(f"⛔ عذراً، هذا الزر للمسؤولين فقط! (ID: {user.id})", show_alert=True)
                 return
-        except:
+        except TelegramError:
              await query.answer(f"⚠️ لا يمكن التحقق من الصلاحيات (ID: {user.id})", show_alert=True)
              return
              
@@ -215,18 +427,9 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer(f"⛔ عذراً، هذا البوت خاص! (ID: {user.id})", show_alert=True)
         return
 
-    # Proceed
-    data = query.data
-    
-    if data == "ignore":
-        await query.answer("هذا مجرد عنوان 🏷️")
-        return
-        
     # 1. ACK immediately
     await query.answer("✅ جاري التنفيذ...", show_alert=False)
     
-    # 2. Load CURRENT settings from GitHub (NOT local)
-    settings = await load_settings()
     target_key = None
     action_type = "toggle"
 
@@ -238,95 +441,119 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         action_type = "sync"
     elif data.startswith("toggle:"):
         target_key = data.split(":")[1]
-        if target_key in SETTINGS_MAP:
+    
+    # 2. Load CURRENT settings (unpushed toggles → GitHub → memory); a toggle holds the lock
+    #    until the new state is pending, so two quick clicks can't overwrite each other
+    async with _settings_lock:
+        settings = await load_settings()
+        if action_type == "toggle" and target_key in SETTINGS_MAP:
             # Toggle value
             settings[target_key] = not settings.get(target_key, True)
-            # Save locally
-            SETTINGS_FILE.write_text(json.dumps(settings, indent=2))
+            # Save locally; pushed in the background once the clicks stop for SYNC_DEBOUNCE seconds
+            await save_settings_local(settings)
+            schedule_push(settings, notify=functools.partial(_show_sync_result, query))
     
-    # 3. Show "Loading" State on Button
-    try:
-        time_str = get_iraq_time()
-        await query.edit_message_text(
-            text=f"⏳ **جاري الاتصال بالسيرفر...**\n📅 {time_str}",
-            reply_markup=build_keyboard(settings, loading_key=target_key), 
-            parse_mode='Markdown'
-        )
-    except Exception as e:
-        logger.warning(f"UI loading update warning: {e}")
+    # 3. Show "Loading" State on Button (runs alongside the GitHub round-trip below)
+    async def show_loading():
+        try:
+            time_str = get_iraq_time()
+            await edit_if_changed(
+                query,
+                f"⏳ **جاري الاتصال بالسيرفر...**\n📅 {time_str}",
+                build_keyboard(settings, loading_key=target_key)
+            )
+        except TelegramError as e:
+            logger.warning(f"UI loading update warning: {e}")
+
+    loading_task = asyncio.create_task(show_loading())
 
-    # 4. Perform Logic (Blocking)
+    # 4. Perform Logic
     synced = False
     
     if action_type == "sync":
-        # Force Pull from GitHub
-        try:
-            subprocess.run(["git", "stash"], check=False) 
-            subprocess.run(["git", "pull", "--rebase"], check=True)
-            # Reload fresh settings from GitHub
-            settings = await load_settings()
-            synced = True
-        except Exception as e:
-            logger.error(f"Git pull failed: {e}")
-            synced = False
+        # Push anything still debounced, then force re-fetch from GitHub (the API copy is the source of truth)
+        if _sync_task and not _sync_task.done():
+            _sync_task.cancel()
+        if await _flush_sync():
+            fresh = await fetch_from_github()
+            synced = fresh is not None
+            if synced:
+                settings = fresh
+                await save_settings_local(settings)
+        else:
+            # GitHub still lacks the staged toggles - keep them and go back to retrying in the background
+            schedule_push(_pending_settings)
             
     elif action_type == "toggle":
-         synced = sync_to_github()
-         # Reload from GitHub to confirm
-         settings = await load_settings()
+         # Already staged by schedule_push() above
+         synced = bool(GITHUB_TOKEN)
          
     else: # refresh
          # Reload from GitHub
          settings = await load_settings()
          synced = True 
 
+    # The loading edit must land before the final one
+    await loading_task
+
     # 5. Final Status Update
-    time_str = get_iraq_time()
-    
     if action_type == "sync":
         status_msg = "📥 **تم جلب أحدث إعدادات**" if synced else "❌ **فشل الاتصال**"
     elif action_type == "refresh":
         status_msg = "🔄 **تم تحديث الواجهة**"
     else:
-        status_msg = "✅ **تم الحفظ والمزامنة**" if synced else "⚠️ **محفوظ محلياً فقط**"
+        status_msg = "✅ **تم الحفظ** (المزامنة خلال ثوانٍ)" if synced else "⚠️ **محفوظ محلياً فقط**"
 
-    final_text = (
-        "👋 **لوحة التحكم**\n"
-        f"📅 الوقت: {time_str}\n"
-        f"📊 الحالة: {status_msg}\n\n"
-        "إليك الإعدادات الحالية:"
-    )
+    final_text = _dashboard_text(status_msg)
     
     for attempt in range(2):
         try:
-            await query.edit_message_text(
-                text=final_text,
-                reply_markup=build_keyboard(settings),
-                parse_mode='Markdown'
-            )
+            await edit_if_changed(query, final_text, build_keyboard(settings))
             break
-        except Exception as e:
+        except BadRequest as e:
             if "Message is not modified" in str(e):
                 logger.info("⚠️ UI already up to date")
                 break
+            raise
+        except TelegramError:
+            # Network / flood errors: one retry
             if attempt == 0: 
                 await asyncio.sleep(1)
 
 if __name__ == '__main__':
     if not TOKEN:
-        print("❌ Error: TELEGRAM_TOKEN not found")
+        logger.error("❌ Error: TELEGRAM_TOKEN not found")
         exit(1)
         
     if not os.getenv('ADMIN_CHAT_ID'):
-        print("⚠️ Warning: ADMIN_CHAT_ID not set")
+        logger.warning("⚠️ Warning: ADMIN_CHAT_ID not set")
         
     if not os.getenv('DEV_CHAT_ID'):
-        print("⚠️ Warning: DEV_CHAT_ID not set")
+        logger.warning("⚠️ Warning: DEV_CHAT_ID not set")
         
-    application = ApplicationBuilder().token(TOKEN).build()
+    # Bursty answer/edit traffic reuses a wider keep-alive pool; getUpdates gets its own
+    # connection whose read timeout outlasts the 30s long-poll below
+    request = HTTPXRequest(connection_pool_size=32, connect_timeout=5, read_timeout=15,
+                           write_timeout=15, pool_timeout=1)
+    updates_request = HTTPXRequest(connection_pool_size=1, connect_timeout=5, read_timeout=40)
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(request)
+        .get_updates_request(updates_request)
+        .concurrent_updates(True)
+        .post_shutdown(_on_shutdown)
+        .build()
+    )
     
     application.add_handler(CommandHandler("settings", start_settings))
-    application.add_handler(CallbackQueryHandler(button_click))
+    application.add_handler(CallbackQueryHandler(button_click, block=False))
     
-    print("✅ Settings Bot (Cloud-Synced) is running...")
-    application.run_polling()
+    logger.info("✅ Settings Bot (Cloud-Synced) is running...")
+    # True long-polling: one getUpdates parks for up to 30s and returns as soon as a click arrives;
+    # only the update types the handlers use are delivered
+    application.run_polling(
+        timeout=30,
+        poll_interval=0.0,
+        allowed_updates=[Update.MESSAGE, Update.CALLBACK_QUERY],
+    )